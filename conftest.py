@@ -0,0 +1,8 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def test_caches(settings):
+    from core.testing import TEST_CACHES
+
+    settings.CACHES = TEST_CACHES
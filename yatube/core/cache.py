@@ -0,0 +1,110 @@
+import math
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+
+from .routers import reading_primary
+
+VERSION_KEY = 'version:{}'
+MODIFIED_KEY = 'modified:{}'
+LOCK_KEY = 'lock:{}'
+LOCK_TIMEOUT = 30
+# Сколько устаревшее значение ещё можно отдавать, пока его пересчитывают.
+STALE_TIMEOUT = 60 * 60
+# Чем больше, тем раньше до истечения срока начинается пересчёт.
+XFETCH_BETA = 1.0
+
+_local = threading.local()
+
+
+def _fresh_version():
+    # Счётчик, потерянный при вытеснении, не должен вернуться к старому
+    # значению, иначе снова станут видны устаревшие записи.
+    return time.time_ns()
+
+
+def get_versions(*names):
+    keys = [VERSION_KEY.format(name) for name in names]
+    versions = cache.get_many(keys)
+    missing = {key: _fresh_version() for key in keys if key not in versions}
+    if missing:
+        for key, version in missing.items():
+            cache.add(key, version, None)
+        missing.update(cache.get_many(list(missing)))
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump_version(*names):
+    for name in names:
+        key = VERSION_KEY.format(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _fresh_version(), None)
+    now = time.time()
+    cache.set_many(
+        {MODIFIED_KEY.format(name): now for name in names}, None)
+
+
+def last_modified(*names):
+    """Время последнего bump_version; None, если хоть одно неизвестно."""
+    keys = [MODIFIED_KEY.format(name) for name in names]
+    times = cache.get_many(keys)
+    if len(times) < len(keys):
+        return None
+    return datetime.fromtimestamp(max(times.values()), timezone.utc)
+
+
+def expires_early(expires, delta, beta=XFETCH_BETA):
+    """Вероятностное раннее истечение (XFetch).
+
+    Чем ближе срок и чем дольше считается значение (delta), тем вероятнее,
+    что очередной запрос решит пересчитать его заранее.
+    """
+    gap = -delta * beta * math.log(1 - random.random())
+    return time.time() + gap >= expires
+
+
+def stale_reads():
+    """Сколько раз get_or_refresh в этом потоке отдал значение старой версии.
+
+    Ответ, собранный из такого значения, нельзя помечать валидаторами
+    новой версии: клиент получил бы 304 на устаревшую страницу.
+    """
+    return getattr(_local, 'stale_reads', 0)
+
+
+def get_or_refresh(key, version, compute, timeout):
+    """Значение из кэша, которое пересчитывает только один запрос.
+
+    Значение устаревает при смене version, по истечении timeout или чуть
+    раньше (expires_early). Пересчитывает его запрос, взявший блокировку
+    через cache.add, остальные пока получают старое. compute читает из
+    основной базы и может вернуть None — тогда ничего не кэшируется.
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        stored_version, expires, delta, value = entry
+        fresh = (stored_version == version
+                 and not expires_early(expires, delta))
+        if fresh or not cache.add(LOCK_KEY.format(key), 1, LOCK_TIMEOUT):
+            if stored_version != version:
+                _local.stale_reads = stale_reads() + 1
+            return value
+    try:
+        started = time.monotonic()
+        with reading_primary():
+            value = compute()
+        delta = time.monotonic() - started
+        if value is not None:
+            cache.set(
+                key, (version, time.time() + timeout, delta, value),
+                timeout + STALE_TIMEOUT)
+    finally:
+        if entry is not None:
+            cache.delete(LOCK_KEY.format(key))
+    return value
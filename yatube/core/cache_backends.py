@@ -0,0 +1,195 @@
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    'key TEXT PRIMARY KEY, value BLOB, expires REAL, accessed REAL)',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+)
+# Время последнего чтения обновляется не чаще, чем раз в столько секунд:
+# иначе каждое чтение было бы записью.
+ACCESS_RESOLUTION = 10
+# Размер таблицы проверяется в среднем раз на столько записей.
+CULL_EVERY = 100
+
+
+class SQLiteCache(BaseCache):
+    """Общий для всех процессов кэш в файле SQLite.
+
+    Работает в WAL-режиме, так что читатели не ждут писателей. Вытесняет
+    давно не читавшиеся записи (приблизительный LRU) при превышении
+    MAX_ENTRIES. Целые числа хранятся как INTEGER, поэтому incr — один
+    атомарный UPDATE.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.location = location
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        # После fork соединение родителя использовать нельзя.
+        if getattr(self.local, 'pid', None) != os.getpid():
+            directory = os.path.dirname(self.location)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(
+                self.location, timeout=30, isolation_level=None,
+                check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def transaction(self):
+        return Transaction(self.connection)
+
+    @staticmethod
+    def encode(value):
+        if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+            return value
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def decode(value):
+        return value if type(value) is int else pickle.loads(value)
+
+    def key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys = {self.key(key, version): key for key in keys}
+        if not keys:
+            return {}
+        now = time.time()
+        rows = self.connection.execute(
+            'SELECT key, value, accessed FROM cache WHERE key IN ({}) '
+            'AND (expires IS NULL OR expires > ?)'.format(
+                ','.join('?' * len(keys))),
+            (*keys, now)).fetchall()
+        stale = [key for key, _, accessed in rows
+                 if accessed < now - ACCESS_RESOLUTION]
+        if stale:
+            self.connection.execute(
+                'UPDATE cache SET accessed = ? WHERE key IN ({})'.format(
+                    ','.join('?' * len(stale))),
+                (now, *stale))
+        return {keys[key]: self.decode(value) for key, value, _ in rows}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        now = time.time()
+        with self.transaction() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                [(self.key(key, version), self.encode(value), expires, now)
+                 for key, value in data.items()])
+        self.maybe_cull(len(data))
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # Занять можно только отсутствующий или истёкший ключ.
+        now = time.time()
+        cursor = self.connection.execute(
+            'INSERT INTO cache VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, '
+            'expires = excluded.expires, accessed = excluded.accessed '
+            'WHERE cache.expires IS NOT NULL AND cache.expires <= ?',
+            (self.key(key, version), self.encode(value),
+             self.get_backend_timeout(timeout), now, now))
+        added = cursor.rowcount == 1
+        if added:
+            self.maybe_cull(1)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        cursor = self.connection.execute(
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), self.key(key, version),
+             time.time()))
+        return cursor.rowcount == 1
+
+    def incr(self, key, delta=1, version=None):
+        key = self.key(key, version)
+        with self.transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE cache SET value = value + ? WHERE key = ? "
+                "AND typeof(value) = 'integer' "
+                "AND (expires IS NULL OR expires > ?)",
+                (delta, key, time.time()))
+            if cursor.rowcount != 1:
+                raise ValueError(f"Key '{key}' not found")
+            return connection.execute(
+                'SELECT value FROM cache WHERE key = ?', (key,)).fetchone()[0]
+
+    def has_key(self, key, version=None):
+        return self.connection.execute(
+            'SELECT 1 FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self.key(key, version), time.time())).fetchone() is not None
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self.key(key, version) for key in keys]
+        if keys:
+            self.connection.execute(
+                'DELETE FROM cache WHERE key IN ({})'.format(
+                    ','.join('?' * len(keys))), keys)
+
+    def clear(self):
+        self.connection.execute('DELETE FROM cache')
+
+    def maybe_cull(self, written):
+        if random.random() * CULL_EVERY >= written:
+            return
+        with self.transaction() as connection:
+            connection.execute(
+                'DELETE FROM cache WHERE expires <= ?', (time.time(),))
+            count = connection.execute(
+                'SELECT count(*) FROM cache').fetchone()[0]
+            if count <= self._max_entries:
+                return
+            cull = count // self._cull_frequency if self._cull_frequency \
+                else count
+            connection.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                'ORDER BY accessed LIMIT ?)', (cull,))
+
+    def close(self, **kwargs):
+        # Соединение живёт весь срок потока, закрывать после запроса незачем.
+        pass
+
+
+class Transaction:
+    """BEGIN IMMEDIATE сразу берёт блокировку записи на весь файл."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import time
+from multiprocessing import get_context
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils.module_loading import import_string
+
+BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'db': 'django.core.cache.backends.db.DatabaseCache',
+    'sqlite': 'core.cache_backends.SQLiteCache',
+}
+VALUE = {'html': 'x' * 2000, 'version': 1}
+
+
+def create_cache(backend, location):
+    return import_string(BACKENDS[backend])(
+        location, {'OPTIONS': {'MAX_ENTRIES': 10 ** 6}})
+
+
+def operations(cache, count):
+    """Операции в секунду на count ключей."""
+    keys = [f'bench:{i}' for i in range(count)]
+    results = {}
+
+    def timed(name, calls, function):
+        started = time.perf_counter()
+        function()
+        results[name] = round(calls / (time.perf_counter() - started))
+
+    timed('set', count, lambda: [cache.set(key, VALUE) for key in keys])
+    timed('get', count, lambda: [cache.get(key) for key in keys])
+    timed('get_many', count, lambda: [
+        cache.get_many(keys[i:i + 10]) for i in range(0, count, 10)])
+    cache.set('bench:counter', 0)
+    timed('incr', count, lambda: [
+        cache.incr('bench:counter') for _ in range(count)])
+    timed('add', count, lambda: [cache.add(key, VALUE) for key in keys])
+    return results
+
+
+def increment(args):
+    backend, location, count = args
+    cache = create_cache(backend, location)
+    for _ in range(count):
+        cache.incr('bench:shared')
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает бэкенды кэша: locmem, db и общий SQLite; '
+        'проверяет, что incr из нескольких процессов ничего не теряет')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keys', type=int, default=5000)
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--increments', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp()
+        location = os.path.join(directory, 'cache.sqlite3')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            call_command('createcachetable', 'bench_cache', verbosity=0)
+            results = {
+                'locmem': operations(
+                    create_cache('locmem', 'bench'), options['keys']),
+                'db': operations(
+                    create_cache('db', 'bench_cache'), options['keys']),
+                'sqlite': operations(
+                    create_cache('sqlite', location), options['keys']),
+            }
+            self.report(results)
+            self.check_atomic(location, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def report(self, results):
+        names = list(next(iter(results.values())))
+        self.stdout.write(
+            f'{"ops/s":<8}' + ''.join(f'{name:>10}' for name in names))
+        for backend, result in results.items():
+            self.stdout.write(
+                f'{backend:<8}'
+                + ''.join(f'{result[name]:>10}' for name in names))
+
+    def check_atomic(self, location, options):
+        processes, count = options['processes'], options['increments']
+        create_cache('sqlite', location).set('bench:shared', 0)
+        started = time.perf_counter()
+        with get_context('fork').Pool(processes) as pool:
+            pool.map(increment, [('sqlite', location, count)] * processes)
+        elapsed = time.perf_counter() - started
+        total = create_cache('sqlite', location).get('bench:shared')
+        expected = processes * count
+        self.stdout.write(
+            f'incr из {processes} процессов: {total} из {expected}, '
+            f'{expected / elapsed:.0f} ops/s')
+        if total != expected:
+            raise CommandError('incr потерял обновления')
@@ -0,0 +1,83 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import template_backends, timing
+
+logger = logging.getLogger(__name__)
+
+UNRESOLVED = '<unresolved>'
+# Сколько самых долгих шаблонов попадает в Server-Timing.
+TEMPLATES_IN_HEADER = 10
+
+
+def slowest(templates, limit=None):
+    return sorted(
+        templates.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+
+
+class TimingMiddleware:
+    """Замеряет запрос и отдаёт разбивку в заголовке Server-Timing.
+
+    Время шаблонов и миниатюр включает выполненные в них SQL-запросы,
+    поэтому сегменты заголовка могут пересекаться.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = timing.start()
+        if settings.TEMPLATE_PROFILING:
+            template_backends.install_profiler()
+            recorder.templates = {}
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(self.sql_wrapper))
+                response = self.get_response(request)
+        finally:
+            timing.stop()
+        recorder.add('total', time.perf_counter() - started)
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else UNRESOLVED
+        metrics = dict(recorder.durations, queries=recorder.queries)
+        timing.record(view_name, metrics)
+        response['Server-Timing'] = self.header(recorder)
+        if recorder.templates:
+            logger.info('%s %s: %s', request.method, request.path, ', '.join(
+                f'{name} ×{count} {duration:.1f} мс'
+                for name, (count, duration) in slowest(recorder.templates)))
+        return response
+
+    @staticmethod
+    def sql_wrapper(execute, sql, params, many, context):
+        recorder = timing.current()
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if recorder is not None:
+                recorder.queries += 1
+                recorder.add('sql', time.perf_counter() - started)
+
+    @staticmethod
+    def header(recorder):
+        parts = []
+        durations = sorted(
+            recorder.durations.items(), key=lambda item: item[0] != 'total')
+        for name, duration in durations:
+            part = f'{name};dur={duration:.1f}'
+            if name == 'sql':
+                part += f';desc="{recorder.queries} queries"'
+            parts.append(part)
+        # Время шаблона включает вложенные в него extends и include.
+        templates = slowest(recorder.templates or {}, TEMPLATES_IN_HEADER)
+        for name, (count, duration) in templates:
+            parts.append(f'tpl;dur={duration:.1f};desc="{name} x{count}"')
+        return ', '.join(parts)
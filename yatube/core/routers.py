@@ -0,0 +1,91 @@
+import random
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+
+STICKY_COOKIE = 'use_primary'
+STICKY_TIMEOUT = 10
+
+_state = threading.local()
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+class ReplicaRouter:
+    """Чтения страниц лент с реплик, запись — только в основную базу.
+
+    Реплики перечислены в settings.DATABASE_REPLICAS; пока список пуст,
+    роутер ничего не меняет. После своей записи пользователь
+    STICKY_TIMEOUT секунд читает с основной базы и видит свои изменения,
+    поэтому отставание реплик должно быть меньше этого окна. Общие кэши
+    заполняются только из основной базы (см. reading_primary).
+    """
+
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if aliases and getattr(_state, 'replica', False):
+            return random.choice(aliases)
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # На репликах те же данные, что и в основной базе.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db not in replicas()
+
+
+@contextmanager
+def _reading(replica):
+    previous = getattr(_state, 'replica', False)
+    _state.replica = replica
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+def reading_replica():
+    return _reading(True)
+
+
+def reading_primary():
+    """Чтения внутри идут в основную базу, даже под replica_reads.
+
+    Так заполняются общие кэши: значение с отстающей реплики легло бы под
+    новую версию и пережило бы само отставание.
+    """
+    return _reading(False)
+
+
+def replica_reads(view):
+    """Запросы view на чтение уходят на реплику, если нет липкой куки."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if (request.method not in ('GET', 'HEAD')
+                or STICKY_COOKIE in request.COOKIES):
+            return view(request, *args, **kwargs)
+        # Сессия и пользователь читаются с основной базы: на отстающей
+        # реплике только что вошедшего пользователя может ещё не быть.
+        request.user.is_authenticated
+        with reading_replica():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+def primary_writes(view):
+    """Ставит липкую куку: следующие чтения пойдут в основную базу."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        response.set_cookie(
+            STICKY_COOKIE, '1', max_age=STICKY_TIMEOUT, httponly=True)
+        return response
+    return wrapper
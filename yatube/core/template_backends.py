@@ -0,0 +1,81 @@
+import logging
+import os
+import time
+from functools import wraps
+
+from django.template import TemplateSyntaxError, engines
+from django.template.backends.django import DjangoTemplates, Template
+from django.template.base import Template as BaseTemplate
+
+from . import timing
+
+logger = logging.getLogger(__name__)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with timing.measure('template'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates, который учитывает время рендера в core.timing."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
+
+
+def profiled(render):
+    @wraps(render)
+    def wrapper(self, context):
+        templates = getattr(timing.current(), 'templates', None)
+        if templates is None:
+            return render(self, context)
+        started = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            entry = templates.setdefault(self.name or '<string>', [0, 0.0])
+            entry[0] += 1
+            entry[1] += (time.perf_counter() - started) * 1000
+    wrapper.profiled = True
+    return wrapper
+
+
+def install_profiler():
+    """Время каждого шаблона, включая extends и include, пишется в запрос.
+
+    Подменяет Template._render так же, как это делает тестовое окружение
+    Django; повторный вызов ничего не меняет.
+    """
+    if not getattr(BaseTemplate._render, 'profiled', False):
+        BaseTemplate._render = profiled(BaseTemplate._render)
+
+
+def warm_up():
+    """Компилирует все шаблоны из DIRS, чтобы их не грузил первый запрос.
+
+    Имеет смысл с cached.Loader: он держит скомпилированные шаблоны. При
+    DEBUG = False Django подключает его сам, если loaders не заданы.
+    """
+    started = time.perf_counter()
+    count = 0
+    for engine in engines.all():
+        for directory in engine.dirs:
+            for root, _, files in os.walk(directory):
+                for filename in files:
+                    name = os.path.relpath(
+                        os.path.join(root, filename), directory)
+                    try:
+                        engine.get_template(name.replace(os.sep, '/'))
+                    except TemplateSyntaxError:
+                        logger.exception('Шаблон %s не компилируется', name)
+                        continue
+                    count += 1
+    logger.info('Скомпилировано шаблонов: %s за %.0f мс', count,
+                (time.perf_counter() - started) * 1000)
+    return count
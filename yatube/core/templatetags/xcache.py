@@ -0,0 +1,45 @@
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+
+from core.cache import get_or_refresh
+
+register = template.Library()
+
+
+class XCacheNode(template.Node):
+    def __init__(self, nodelist, timeout, name, vary_on, version):
+        self.nodelist = nodelist
+        self.timeout = timeout
+        self.name = name
+        self.vary_on = vary_on
+        self.version = version
+
+    def render(self, context):
+        timeout = int(self.timeout.resolve(context))
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        version = self.version.resolve(context) if self.version else None
+        return get_or_refresh(
+            make_template_fragment_key(self.name, vary_on), version,
+            lambda: self.nodelist.render(context), timeout)
+
+
+@register.tag
+def xcache(parser, token):
+    """Как {% cache %}, но без давки при истечении фрагмента.
+
+    {% xcache 20 index_page request.GET.page version=feed_version %}
+    Смена version не меняет ключ: пока один запрос пересчитывает фрагмент,
+    остальные получают прежний.
+    """
+    nodelist = parser.parse(('endxcache',))
+    parser.delete_first_token()
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(
+            f'{bits[0]} требует время жизни и имя фрагмента')
+    version = None
+    if bits[-1].startswith('version='):
+        version = parser.compile_filter(bits.pop()[len('version='):])
+    return XCacheNode(
+        nodelist, parser.compile_filter(bits[1]), bits[2],
+        [parser.compile_filter(bit) for bit in bits[3:]], version)
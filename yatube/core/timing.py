@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Сколько последних замеров хранится на каждую метрику каждого view.
+SAMPLES = 1000
+PERCENTILES = (50, 95, 99)
+
+_local = threading.local()
+_lock = threading.Lock()
+_samples = defaultdict(lambda: defaultdict(lambda: deque(maxlen=SAMPLES)))
+
+
+class Recorder:
+    """Замеры одного запроса: длительности в мс и число SQL-запросов."""
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.queries = 0
+        # Имя шаблона: [число рендеров, мс]; None, если профилирование
+        # шаблонов выключено.
+        self.templates = None
+
+    def add(self, name, duration):
+        self.durations[name] += duration * 1000
+
+
+def start():
+    _local.recorder = Recorder()
+    return _local.recorder
+
+
+def stop():
+    return _local.__dict__.pop('recorder', None)
+
+
+def current():
+    return getattr(_local, 'recorder', None)
+
+
+@contextmanager
+def measure(name):
+    """Добавляет время блока к метрике name текущего запроса."""
+    recorder = current()
+    if recorder is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.add(name, time.perf_counter() - started)
+
+
+def record(view_name, metrics):
+    with _lock:
+        for name, value in metrics.items():
+            _samples[view_name][name].append(value)
+
+
+def percentile(values, p):
+    index = max(0, -(-len(values) * p // 100) - 1)
+    return values[int(index)]
+
+
+def stats():
+    """p50/p95/p99 по каждой метрике каждого view."""
+    with _lock:
+        snapshot = {
+            view_name: {name: sorted(values)
+                        for name, values in metrics.items()}
+            for view_name, metrics in _samples.items()
+        }
+    return {
+        view_name: {
+            name: {
+                'count': len(values),
+                **{f'p{p}': round(percentile(values, p), 2)
+                   for p in PERCENTILES},
+            }
+            for name, values in metrics.items()
+        }
+        for view_name, metrics in snapshot.items()
+    }
+
+
+def reset():
+    with _lock:
+        _samples.clear()
@@ -1,7 +1,11 @@
 from http import HTTPStatus
 
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
 from django.shortcuts import render
 
+from . import timing
+
 
 def page_not_found(request, exception):
     return render(request, 'core/404.html',
@@ -18,3 +22,8 @@ def csrf_failure(request, reason=''):
 
 def permission_denied(request, reason=''):
     return render(request, 'core/403csrf.html', HTTPStatus.FORBIDDEN)
+
+
+@staff_member_required
+def timings(request):
+    return JsonResponse(timing.stats(), json_dumps_params={'indent': 2})
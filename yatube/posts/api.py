@@ -0,0 +1,67 @@
+from django.http import JsonResponse
+
+from .thumbnails import GEOMETRIES, ready_thumbnail
+from .utils import NUM, CursorPaginator
+
+# Поле ответа и откуда его взять в values().
+FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'pub_date': 'pub_date',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'image': 'image',
+    'comments_count': 'comments_count',
+}
+COMPACT = {'separators': (',', ':'), 'ensure_ascii': False}
+
+
+def parse_fields(value):
+    if not value:
+        return tuple(FIELDS)
+    fields = tuple(dict.fromkeys(
+        field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in FIELDS]
+    if unknown or not fields:
+        raise ValueError(
+            f'Неизвестные поля: {", ".join(unknown)}; '
+            f'доступны {", ".join(FIELDS)}')
+    return fields
+
+
+def thumbnail_url(name):
+    geometry, options = GEOMETRIES[0]
+    thumbnail = ready_thumbnail(name, geometry, **options)
+    return thumbnail.url if thumbnail is not None else None
+
+
+def serialize(row, fields):
+    item = {field: row[FIELDS[field]] for field in fields}
+    if 'image' in item:
+        item['image'] = thumbnail_url(item['image'])
+    return item
+
+
+def feed_page(queryset, fields, cursor=None, paginator=CursorPaginator):
+    """Страница ленты из values(): без моделей и шаблонов.
+
+    id и pub_date выбираются всегда, по ним строится курсор.
+    """
+    lookups = {FIELDS[field] for field in fields} | {'id', 'pub_date'}
+    rows = queryset.values(*lookups)
+    page = paginator(rows, NUM).page_from_cursor(cursor)
+    return {
+        'results': [serialize(row, fields) for row in page],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }
+
+
+def feed_response(request, queryset, paginator=CursorPaginator):
+    try:
+        fields = parse_fields(request.GET.get('fields'))
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse(
+        feed_page(queryset, fields, request.GET.get('cursor'), paginator),
+        json_dumps_params=COMPACT)
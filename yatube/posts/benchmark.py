@@ -0,0 +1,256 @@
+import io
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import OperationalError, connection
+from django.test import Client
+from django.urls import reverse
+from faker import Faker
+from PIL import Image
+
+from core.timing import percentile
+
+from . import counters, thumbnails, timeline
+from .models import Comment, Follow, Group, Post, User, UserCounters
+
+QUERIES = re.compile(r'sql;[^,]*desc="(\d+) queries"')
+
+
+def _images(count, rnd):
+    names = []
+    for i in range(count):
+        buffer = io.BytesIO()
+        color = tuple(rnd.randrange(256) for _ in range(3))
+        Image.new('RGB', (800, 600), color).save(buffer, 'JPEG')
+        names.append(default_storage.save(
+            f'posts/bench_{i}.jpg', ContentFile(buffer.getvalue())))
+    return names
+
+
+def seed(users=100, groups=10, posts=1000, comments=2000, follows=500,
+         images=20, seed=0):
+    """Наполняет базу детерминированным набором данных.
+
+    Всё пишется через bulk_create, поэтому счётчики, ленты и миниатюры
+    досчитываются отдельно, как после импорта.
+    """
+    rnd = random.Random(seed)
+    fake = Faker('ru_RU')
+    fake.seed_instance(seed)
+    User.objects.bulk_create(
+        (User(username=f'bench{i}', first_name=fake.first_name(),
+              last_name=fake.last_name())
+         for i in range(users)))
+    user_ids = list(User.objects.values_list('pk', flat=True))
+    Group.objects.bulk_create(
+        (Group(title=fake.sentence(nb_words=3)[:200], slug=f'bench-{i}',
+               description=fake.paragraph())
+         for i in range(groups)))
+    group_ids = list(Group.objects.values_list('pk', flat=True))
+    image_names = _images(images, rnd)
+    # Картинка есть примерно у трети постов.
+    image_names += [''] * (len(image_names) * 2 or 1)
+    Post.objects.bulk_create(
+        (Post(author_id=rnd.choice(user_ids),
+              group_id=rnd.choice(group_ids + [None]),
+              text=fake.paragraph(nb_sentences=5),
+              image=rnd.choice(image_names))
+         for _ in range(posts)))
+    post_ids = list(Post.objects.values_list('pk', flat=True))
+    Comment.objects.bulk_create(
+        (Comment(post_id=rnd.choice(post_ids),
+                 author_id=rnd.choice(user_ids),
+                 text=fake.sentence())
+         for _ in range(comments)))
+    pairs = {
+        (rnd.choice(user_ids), rnd.choice(user_ids))
+        for _ in range(follows)}
+    Follow.objects.bulk_create(
+        (Follow(user_id=user_id, author_id=author_id)
+         for user_id, author_id in pairs if user_id != author_id),
+        ignore_conflicts=True)
+    UserCounters.objects.bulk_create(
+        (UserCounters(user_id=user_id) for user_id in user_ids),
+        ignore_conflicts=True)
+    counters.reconcile()
+    for user_id, author_id in Follow.objects.values_list(
+            'user_id', 'author_id').iterator():
+        timeline.backfill(user_id, author_id)
+    thumbnails.store(map(thumbnails.render, filter(None, image_names)))
+    return targets()
+
+
+def targets():
+    """Страницы, которые меряет бенчмарк: самые тяжёлые из набора."""
+    author = User.objects.order_by('-counters__posts_count').first()
+    reader = User.objects.order_by('-counters__following_count').first()
+    group = Group.objects.order_by('-posts_count').first()
+    post = Post.objects.order_by('-comments_count').first()
+    pages = {
+        'index': (reverse('posts:index'), None),
+        'index_page_2': (reverse('posts:index') + '?page=2', None),
+        'follow_index': (reverse('posts:follow_index'), reader),
+        'api_index': (reverse('posts:api_index'), None),
+        'api_follow': (reverse('posts:api_follow'), reader),
+    }
+    if author is not None:
+        pages['profile'] = (
+            reverse('posts:profile', args=(author.username,)), None)
+    if group is not None:
+        pages['group_posts'] = (
+            reverse('posts:group_list', args=(group.slug,)), None)
+    if post is not None:
+        pages['post_detail'] = (
+            reverse('posts:post_detail', args=(post.pk,)), None)
+        query = urlencode({'q': post.text.split()[0]})
+        pages['search'] = (reverse('posts:search') + f'?{query}', None)
+    return pages
+
+
+def _measure(url, cookies, count, cold):
+    client = Client()
+    client.cookies = cookies
+    samples = []
+    try:
+        for _ in range(count):
+            if cold:
+                cache.clear()
+            started = time.perf_counter()
+            response = client.get(url)
+            elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code != 200:
+                raise RuntimeError(f'{url} ответил {response.status_code}')
+            match = QUERIES.search(response.get('Server-Timing', ''))
+            samples.append((elapsed, int(match.group(1)) if match else None))
+    finally:
+        connection.close()
+    return samples
+
+
+def run(targets, requests=200, concurrency=4, cold=False):
+    """Гоняет каждую страницу requests раз в concurrency потоков."""
+    results = {}
+    for name, (url, user) in targets.items():
+        cache.clear()
+        # Сессия создаётся заранее: параллельные записи в SQLite в памяти
+        # упираются в блокировку таблицы.
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        shares = [requests // concurrency] * concurrency
+        shares[0] += requests % concurrency
+        started = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                chunks = list(pool.map(
+                    lambda share: _measure(
+                        url, client.cookies.copy(), share, cold),
+                    shares))
+        else:
+            chunks = [_measure(url, client.cookies, requests, cold)]
+        elapsed = time.perf_counter() - started
+        samples = [sample for chunk in chunks for sample in chunk]
+        latencies = sorted(latency for latency, _ in samples)
+        queries = [count for _, count in samples if count is not None]
+        results[name] = {
+            'url': url,
+            'requests': len(samples),
+            'rps': round(len(samples) / elapsed, 1),
+            **{f'p{p}': round(percentile(latencies, p), 2)
+               for p in (50, 95, 99)},
+            'queries': max(queries) if queries else None,
+        }
+    return results
+
+
+def _mixed(urls, post_url, cookies, deadline, write):
+    client = Client()
+    client.cookies = cookies
+    samples, errors = [], 0
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                if write:
+                    response = client.post(post_url, {'text': 'Комментарий'})
+                else:
+                    response = client.get(urls[len(samples) % len(urls)])
+            except OperationalError:
+                errors += 1
+                continue
+            if response.status_code not in (200, 302):
+                errors += 1
+                continue
+            samples.append((time.perf_counter() - started) * 1000)
+    finally:
+        connection.close()
+    return write, samples, errors
+
+
+def contention(readers=4, writers=2, duration=5.0):
+    """Чтения лент вперемешку с комментариями из нескольких потоков.
+
+    Нужна база в файле: в памяти SQLite блокирует таблицы целиком.
+    """
+    post = Post.objects.order_by('-comments_count').first()
+    writer = User.objects.order_by('pk').first()
+    urls = [
+        reverse('posts:index'),
+        reverse('posts:profile', args=(post.author.username,)),
+        reverse('posts:post_detail', args=(post.pk,)),
+    ]
+    post_url = reverse('posts:add_comment', args=(post.pk,))
+    client = Client()
+    client.force_login(writer)
+    deadline = time.perf_counter() + duration
+    with ThreadPoolExecutor(max_workers=readers + writers) as pool:
+        chunks = list(pool.map(
+            lambda write: _mixed(
+                urls, post_url, client.cookies.copy(), deadline, write),
+            [False] * readers + [True] * writers))
+    results = {}
+    for kind, write in (('reads', False), ('writes', True)):
+        latencies = sorted(
+            sample for is_write, samples, _ in chunks if is_write == write
+            for sample in samples)
+        results[kind] = {
+            'requests': len(latencies),
+            'rps': round(len(latencies) / duration, 1),
+            **{f'p{p}': round(percentile(latencies, p), 2) if latencies
+               else None for p in (50, 95, 99)},
+            'errors': sum(
+                errors for is_write, _, errors in chunks
+                if is_write == write),
+        }
+    return results
+
+
+def compare(results, baseline=None, tolerance=1.25,
+            max_p95=None, max_queries=None):
+    """Список нарушений порогов; пустой, если регрессий нет."""
+    failures = []
+    for name, result in results.items():
+        if max_p95 is not None and result['p95'] > max_p95:
+            failures.append(f'{name}: p95 {result["p95"]} мс > {max_p95}')
+        if (max_queries is not None and result['queries'] is not None
+                and result['queries'] > max_queries):
+            failures.append(
+                f'{name}: {result["queries"]} запросов > {max_queries}')
+        previous = (baseline or {}).get(name)
+        if previous is None:
+            continue
+        if result['p95'] > previous['p95'] * tolerance:
+            failures.append(
+                f'{name}: p95 {result["p95"]} мс, '
+                f'в базовой линии {previous["p95"]}')
+        if (result['queries'] or 0) > (previous['queries'] or 0):
+            failures.append(
+                f'{name}: {result["queries"]} запросов, '
+                f'в базовой линии {previous["queries"]}')
+    return failures
@@ -0,0 +1,57 @@
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from .models import Post
+
+CARD_KEY = 'card:{}:{}'
+CARD_TIMEOUT = 24 * 60 * 60
+# Чем карточки разных лент отличаются друг от друга.
+VARIANTS = {
+    'index': {'geometry': '400x443', 'author_link': True, 'group_link': True},
+    'group': {'geometry': '400x443', 'author_link': True, 'group_link': False},
+    'profile': {
+        'geometry': '400x443', 'author_link': False, 'group_link': False},
+    'follow': {'geometry': '400x439', 'author_link': True, 'group_link': True},
+}
+
+
+def render_card(post, variant):
+    return render_to_string(
+        'includes/post_card.html', {'post': post, **VARIANTS[variant]})
+
+
+def refresh(posts):
+    """Перерисовывает карточки постов во всех вариантах."""
+    cache.set_many({
+        CARD_KEY.format(variant, post.pk): render_card(post, variant)
+        for post in posts for variant in VARIANTS}, CARD_TIMEOUT)
+
+
+def forget(post_ids):
+    """Карточки перерисуются при следующем показе."""
+    cache.delete_many([
+        CARD_KEY.format(variant, post_id)
+        for post_id in post_ids for variant in VARIANTS])
+
+
+def forget_author(author_id):
+    forget(Post.objects.filter(
+        author_id=author_id).values_list('pk', flat=True))
+
+
+def forget_group(group_id):
+    forget(Post.objects.filter(
+        group_id=group_id).values_list('pk', flat=True))
+
+
+def get_cards(posts, variant):
+    """HTML карточек в порядке posts; недостающие рисуются и сохраняются."""
+    keys = [CARD_KEY.format(variant, post.pk) for post in posts]
+    stored = cache.get_many(keys)
+    missing = {
+        key: render_card(post, variant)
+        for key, post in zip(keys, posts) if key not in stored}
+    if missing:
+        cache.set_many(missing, CARD_TIMEOUT)
+        stored.update(missing)
+    return [stored[key] for key in keys]
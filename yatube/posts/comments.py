@@ -0,0 +1,43 @@
+from core.cache import get_or_refresh
+
+from . import feeds
+from .models import Comment
+from .utils import COMMENTS_NUM, CommentPaginator, CursorPage
+
+FIRST_PAGE_KEY = 'comments:{}'
+FIRST_PAGE_TIMEOUT = 60 * 60
+
+
+def comments_page(post_id, cursor=None):
+    """Страница комментариев поста, новые сверху, авторы одним JOIN.
+
+    Первая страница хранится в кэше под версией поста: новый или удалённый
+    комментарий меняет версию (см. signals), и страница пересчитывается.
+    """
+    # Из автора нужен только username: строки лежат в общем кэше, и хэшам
+    # паролей и почте там не место.
+    comments = Comment.objects.filter(post_id=post_id).select_related(
+        'author').only('text', 'created', 'author', 'author__username')
+    paginator = CommentPaginator(comments, COMMENTS_NUM)
+    if cursor:
+        return paginator.page_from_cursor(cursor)
+
+    def first_page():
+        page = paginator.page_from_cursor(None)
+        # Сама страница тянет за собой queryset, в кэш идут только строки.
+        return list(page.object_list), page.next_cursor
+
+    rows, next_cursor = get_or_refresh(
+        FIRST_PAGE_KEY.format(post_id),
+        feeds.feed_version(feeds.post_key(post_id)),
+        first_page, FIRST_PAGE_TIMEOUT)
+    return CursorPage(rows, paginator, next_cursor)
+
+
+def serialize(comment):
+    return {
+        'id': comment.pk,
+        'author': comment.author.username,
+        'text': comment.text,
+        'created': comment.created,
+    }
@@ -0,0 +1,86 @@
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from . import timeline
+from .models import Comment, Follow, Group, Post, User, UserCounters
+
+
+def _deltas(**deltas):
+    return {
+        field: Greatest(F(field) + delta, Value(0))
+        for field, delta in deltas.items()
+    }
+
+
+def change_user(user_id, **deltas):
+    counters = UserCounters.objects.filter(user_id=user_id)
+    updated = counters.update(**_deltas(**deltas))
+    if not updated and max(deltas.values()) > 0:
+        UserCounters.objects.get_or_create(user_id=user_id)
+        counters.update(**_deltas(**deltas))
+
+
+def change_post(post_id, **deltas):
+    # update() не трогает auto_now, а по updated идёт инкрементальный
+    # экспорт, где есть и счётчики.
+    Post.objects.filter(pk=post_id).update(
+        **_deltas(**deltas), updated=timezone.now())
+
+
+def change_group(group_id, **deltas):
+    if group_id is not None:
+        Group.objects.filter(pk=group_id).update(
+            **_deltas(**deltas), updated=timezone.now())
+
+
+def _count(model, field, outer='pk'):
+    rows = (
+        model.objects.filter(**{field: OuterRef(outer)})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(rows), 0)
+
+
+def reconcile():
+    """Пересчитывает счётчики, возвращает число исправленных строк."""
+    missing = User.objects.filter(counters=None).values_list('pk', flat=True)
+    UserCounters.objects.bulk_create(
+        (UserCounters(user_id=user_id) for user_id in missing),
+        ignore_conflicts=True)
+    targets = (
+        (UserCounters, {
+            'posts_count': _count(Post, 'author', 'user'),
+            'followers_count': _count(Follow, 'author', 'user'),
+            'following_count': _count(Follow, 'user', 'user'),
+        }),
+        (Post, {'comments_count': _count(Comment, 'post')}),
+        (Group, {'posts_count': _count(Post, 'group')}),
+    )
+    fixed = {}
+    with transaction.atomic():
+        for model, counts in targets:
+            actual = {f'actual_{field}': expression
+                      for field, expression in counts.items()}
+            drift = reduce(or_, (
+                ~Q(**{field: F(f'actual_{field}')}) for field in counts))
+            drifted = model.objects.annotate(**actual).filter(drift)
+            fixed[model._meta.model_name] = drifted.count()
+            changes = dict(counts)
+            if model is not UserCounters:
+                changes['updated'] = timezone.now()
+            model.objects.filter(
+                pk__in=drifted.values('pk')).update(**changes)
+        # Подписки, вставленные в обход сигналов, тоже делают автора
+        # «тянущим».
+        UserCounters.objects.filter(
+            followers_count__gt=timeline.FANOUT_LIMIT, pulled=False,
+        ).update(pulled=True)
+    return fixed
@@ -0,0 +1,97 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Comment, Follow, Group, Post
+
+CHUNK_SIZE = 2000
+
+# Таблица: модель, выгружаемые поля и поле для инкрементальной выгрузки.
+TABLES = {
+    'groups': (
+        Group,
+        ('id', 'title', 'slug', 'description', 'posts_count', 'updated'),
+        'updated'),
+    'posts': (
+        Post,
+        ('id', 'author_id', 'group_id', 'text', 'image', 'pub_date',
+         'comments_count', 'updated'),
+        'updated'),
+    'comments': (
+        Comment,
+        ('id', 'post_id', 'author_id', 'text', 'created', 'updated'),
+        'updated'),
+    'follows': (
+        Follow,
+        ('id', 'user_id', 'author_id', 'created'),
+        'created'),
+}
+FORMATS = ('ndjson', 'csv')
+
+
+def parse_since(value):
+    since = parse_datetime(value)
+    if since is None:
+        raise ValueError('Неверный формат даты')
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+def rows(table, since=None, chunk_size=None):
+    """Кортежи строк таблицы окнами по pk: память не зависит от размера.
+
+    since отбирает строки, созданные или изменённые начиная с этого
+    момента; удалённые строки инкрементальная выгрузка не видит.
+    """
+    model, fields, changed = TABLES[table]
+    chunk_size = chunk_size or CHUNK_SIZE
+    queryset = model.objects.order_by('pk').values_list(*fields)
+    if since is not None:
+        queryset = queryset.filter(**{f'{changed}__gte': since})
+    last_pk = 0
+    while True:
+        window = queryset.filter(pk__gt=last_pk)[:chunk_size]
+        count = 0
+        for row in window.iterator(chunk_size=chunk_size):
+            count += 1
+            yield row
+        if count < chunk_size:
+            return
+        last_pk = row[0]
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def ndjson(tables, since=None):
+    """Строки нескольких таблиц, у каждой записи есть ключ table."""
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for table in tables:
+        fields = TABLES[table][1]
+        for row in rows(table, since):
+            record = {'table': table, **dict(zip(fields, row))}
+            yield encoder.encode(record) + '\n'
+
+
+def csv_lines(table, since=None):
+    writer = csv.writer(Echo())
+    yield writer.writerow(TABLES[table][1])
+    for row in rows(table, since):
+        yield writer.writerow(row)
+
+
+def stream(tables, format_='ndjson', since=None):
+    if format_ == 'csv':
+        if len(tables) != 1:
+            raise ValueError('CSV выгружает ровно одну таблицу')
+        return csv_lines(tables[0], since)
+    return ndjson(tables, since)
+
+
+def content_type(format_):
+    return 'text/csv' if format_ == 'csv' else 'application/x-ndjson'
@@ -0,0 +1,162 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import condition
+
+from core.cache import (bump_version, get_or_refresh, get_versions,
+                        last_modified, stale_reads)
+
+INDEX_FEED = 'feed:index'
+FOLLOW_FEED = 'feed:follow'
+PAGE_KEY = 'page:{}'
+PAGE_TIMEOUT = 60
+
+
+def group_feed(group_id):
+    return f'feed:group:{group_id}'
+
+
+def profile_feed(author_id):
+    return f'feed:profile:{author_id}'
+
+
+def user_follow_feed(user_id):
+    return f'feed:follow:{user_id}'
+
+
+def post_key(post_id):
+    return f'post:{post_id}'
+
+
+def feed_version(*feeds):
+    return '.'.join(str(version) for version in get_versions(*feeds))
+
+
+def invalidate_post(post, previous_group_id=None):
+    feeds = [INDEX_FEED, FOLLOW_FEED, profile_feed(post.author_id),
+             post_key(post.pk)]
+    for group_id in {post.group_id, previous_group_id} - {None}:
+        feeds.append(group_feed(group_id))
+    bump_version(*feeds)
+
+
+def invalidate_posts(author_ids, group_ids):
+    """Сбрасывает ленты после массовой вставки постов в обход сигналов."""
+    bump_version(
+        INDEX_FEED, FOLLOW_FEED,
+        *(profile_feed(author_id) for author_id in author_ids),
+        *(group_feed(group_id) for group_id in group_ids - {None}))
+
+
+def invalidate_group(group_id):
+    """Страницы постов группы зависят от group_feed и тоже обновятся."""
+    bump_version(INDEX_FEED, FOLLOW_FEED, group_feed(group_id))
+
+
+def invalidate_author(author_id, group_ids=(), post_ids=()):
+    """Страницы с именем автора: его ленты и посты с его комментариями."""
+    bump_version(
+        INDEX_FEED, FOLLOW_FEED, profile_feed(author_id),
+        *(group_feed(group_id) for group_id in set(group_ids) - {None}),
+        *(post_key(post_id) for post_id in post_ids))
+
+
+def page_feeds(request, get_feeds, kwargs):
+    if not hasattr(request, '_page_feeds'):
+        request._page_feeds = get_feeds(request, **kwargs)
+    return request._page_feeds
+
+
+def conditional(get_feeds):
+    """Conditional GET по версиям лент, без рендера страницы.
+
+    get_feeds(request, **kwargs) возвращает имена лент, от которых зависит
+    страница, или None, если её не найти. ETag учитывает пользователя и
+    его CSRF-куку, Last-Modified отдаётся только анонимам: у них страница
+    от пользователя не зависит. Страница, собранная из устаревших значений
+    кэша, уходит без валидаторов.
+    """
+    def etag(request, *args, **kwargs):
+        feeds = page_feeds(request, get_feeds, kwargs)
+        if feeds is None:
+            return None
+        parts = [feed_version(*feeds), request.GET.urlencode()]
+        if request.user.is_authenticated:
+            parts += [str(request.user.pk),
+                      request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')]
+        return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+    def modified(request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return None
+        feeds = page_feeds(request, get_feeds, kwargs)
+        return last_modified(*feeds) if feeds is not None else None
+
+    check = condition(etag_func=etag, last_modified_func=modified)
+
+    def decorator(view):
+        checked = check(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            before = stale_reads()
+            response = checked(request, *args, **kwargs)
+            if stale_reads() != before:
+                del response['ETag']
+                del response['Last-Modified']
+            return response
+        return wrapper
+    return decorator
+
+
+def page_key(path):
+    return PAGE_KEY.format(hashlib.md5(path.encode()).hexdigest())
+
+
+def is_anonymous(request):
+    # Без сессионной куки пользователь точно аноним, а сессию не нужно
+    # даже загружать.
+    return (request.method in ('GET', 'HEAD')
+            and settings.SESSION_COOKIE_NAME not in request.COOKIES)
+
+
+def cacheable(response):
+    return (response.status_code == 200 and not response.streaming
+            and not response.cookies)
+
+
+def anonymous_cache(get_feeds, timeout=PAGE_TIMEOUT):
+    """Кэш целых страниц для анонимов, сбрасываемый версиями лент."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            feeds = None
+            if is_anonymous(request):
+                feeds = page_feeds(request, get_feeds, kwargs)
+            if feeds is None:
+                return view(request, *args, **kwargs)
+            rendered = []
+
+            def render():
+                before = stale_reads()
+                response = view(request, *args, **kwargs)
+                rendered.append(response)
+                # Со старыми фрагментами страница не годится для новой версии.
+                if not cacheable(response) or stale_reads() != before:
+                    return None
+                return response.content, dict(response.items())
+
+            page = get_or_refresh(
+                page_key(request.get_full_path()), feed_version(*feeds),
+                render, timeout)
+            if page is None:
+                return rendered[0]
+            content, headers = page
+            response = HttpResponse(content)
+            for header, value in headers.items():
+                response[header] = value
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,43 @@
+from array import array
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Follow
+
+FOLLOWING_KEY = 'following:{}'
+FOLLOWING_TIMEOUT = 24 * 60 * 60
+# Отсортированные id авторов по 4 байта: компактнее pickle множества.
+TYPECODE = 'I'
+
+
+def followed_ids(user_id):
+    """Множество id авторов, на которых подписан пользователь."""
+    key = FOLLOWING_KEY.format(user_id)
+    packed = cache.get(key)
+    if packed is None:
+        # Из основной базы: отставшая реплика закэшировала бы старое.
+        packed = array(TYPECODE, sorted(
+            Follow.objects.using('default').filter(
+                user_id=user_id).values_list('author_id', flat=True)
+        )).tobytes()
+        cache.set(key, packed, FOLLOWING_TIMEOUT)
+    ids = array(TYPECODE)
+    ids.frombytes(packed)
+    return frozenset(ids)
+
+
+def viewer_follows(request):
+    """Подписки пользователя запроса; на запрос читаются один раз."""
+    if not request.user.is_authenticated:
+        return frozenset()
+    if not hasattr(request, '_followed_ids'):
+        request._followed_ids = followed_ids(request.user.pk)
+    return request._followed_ids
+
+
+def forget(user_id):
+    key = FOLLOWING_KEY.format(user_id)
+    cache.delete(key)
+    # Параллельный запрос мог положить старое множество до коммита.
+    transaction.on_commit(lambda: cache.delete(key))
@@ -0,0 +1,104 @@
+import json
+import os
+import platform
+import shutil
+import tempfile
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+
+from posts import benchmark
+
+SIZES = ('users', 'groups', 'posts', 'comments', 'follows', 'images')
+
+
+class Command(BaseCommand):
+    help = (
+        'Наполняет временную базу и меряет страницы постов; '
+        'падает, если превышены пороги или базовая линия')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--comments', type=int, default=10000)
+        parser.add_argument('--follows', type=int, default=2000)
+        parser.add_argument('--images', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Очищать кэш перед каждым запросом')
+        parser.add_argument('--output', help='Куда сохранить результаты')
+        parser.add_argument('--baseline', help='Файл с базовой линией')
+        parser.add_argument(
+            '--tolerance', type=float, default=1.25,
+            help='Во сколько раз p95 может превысить базовую линию')
+        parser.add_argument('--max-p95', type=float, help='Порог p95, мс')
+        parser.add_argument('--max-queries', type=int)
+
+    def handle(self, *args, **options):
+        sizes = {size: options[size] for size in SIZES}
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)['results']
+        results = self.measure(sizes, options)
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump({
+                    'meta': {
+                        **sizes,
+                        'seed': options['seed'],
+                        'requests': options['requests'],
+                        'concurrency': options['concurrency'],
+                        'cold': options['cold'],
+                        'python': platform.python_version(),
+                        'django': django.get_version(),
+                    },
+                    'results': results,
+                }, file, indent=2, ensure_ascii=False)
+        failures = benchmark.compare(
+            results, baseline, options['tolerance'],
+            options['max_p95'], options['max_queries'])
+        if failures:
+            raise CommandError('\n'.join(failures))
+
+    def measure(self, sizes, options):
+        # Данные сеются в отдельную тестовую базу, рабочая не трогается.
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        directory = tempfile.mkdtemp()
+        # Бенчмарк чистит кэш и кладёт в него карточки выдуманных постов:
+        # рабочий файл кэша ему не достаётся.
+        caches = {'default': dict(
+            settings.CACHES['default'],
+            LOCATION=os.path.join(directory, 'cache.sqlite3'))}
+        try:
+            with override_settings(MEDIA_ROOT=directory, CACHES=caches):
+                targets = benchmark.seed(seed=options['seed'], **sizes)
+                return benchmark.run(
+                    targets, options['requests'], options['concurrency'],
+                    options['cold'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def report(self, results):
+        self.stdout.write(
+            f'{"страница":<14}{"rps":>8}{"p50":>9}{"p95":>9}{"p99":>9}'
+            f'{"SQL":>6}')
+        for name, result in results.items():
+            queries = result['queries']
+            self.stdout.write(
+                f'{name:<14}{result["rps"]:>8}{result["p50"]:>9}'
+                f'{result["p95"]:>9}{result["p99"]:>9}'
+                f'{"-" if queries is None else queries:>6}')
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+
+from posts import benchmark
+
+# Режим SQLite по умолчанию против настроек проекта.
+MODES = {
+    'default': ({'journal_mode': 'delete', 'synchronous': 'full'}, 0),
+    'tuned': (settings.SQLITE_PRAGMAS,
+              settings.DATABASES['default'].get('CONN_MAX_AGE', 0)),
+}
+DUMMY_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+class Command(BaseCommand):
+    help = (
+        'Гоняет чтения лент вперемешку с комментариями на SQLite в файле '
+        'в режиме по умолчанию и с прагмами проекта')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--duration', type=float, default=5.0)
+        parser.add_argument('--posts', type=int, default=2000)
+        parser.add_argument('--modes', nargs='+', choices=MODES,
+                            default=list(MODES))
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'{"режим":<10}{"":<8}{"rps":>8}{"p50":>9}{"p95":>9}{"p99":>9}'
+            f'{"ошибки":>8}')
+        for mode in options['modes']:
+            results = self.measure(mode, options)
+            for kind, result in results.items():
+                self.stdout.write(
+                    f'{mode:<10}{kind:<8}{result["rps"]:>8}'
+                    f'{result["p50"]!s:>9}{result["p95"]!s:>9}'
+                    f'{result["p99"]!s:>9}{result["errors"]:>8}')
+
+    def measure(self, mode, options):
+        pragmas, conn_max_age = MODES[mode]
+        directory = tempfile.mkdtemp()
+        # Кэш отключён, чтобы каждое чтение доходило до базы.
+        with override_settings(
+                SQLITE_PRAGMAS=pragmas, CACHES=DUMMY_CACHE,
+                MEDIA_ROOT=directory):
+            settings_dict = connection.settings_dict
+            old_test_name = settings_dict['TEST']['NAME']
+            old_conn_max_age = settings_dict['CONN_MAX_AGE']
+            settings_dict['TEST']['NAME'] = os.path.join(
+                directory, 'bench.sqlite3')
+            settings_dict['CONN_MAX_AGE'] = conn_max_age
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False)
+            try:
+                benchmark.seed(
+                    users=50, posts=options['posts'],
+                    comments=options['posts'], follows=200, images=0)
+                return benchmark.contention(
+                    options['readers'], options['writers'],
+                    options['duration'])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+                settings_dict['CONN_MAX_AGE'] = old_conn_max_age
+                settings_dict['TEST']['NAME'] = old_test_name
+                shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,68 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.models import Comment, Follow, Group, Post, User
+from posts.timeline import Timeline
+from posts.utils import NUM
+
+# Признаки плана без подходящего индекса: полный просмотр таблицы или
+# сортировка во временном дереве.
+WARNING = re.compile(r'SCAN \w+$|TEMP B-TREE', re.MULTILINE)
+
+
+def hot_queries():
+    """Запросы, которые выполняются на каждой странице ленты."""
+    author = User.objects.order_by('-counters__posts_count').first()
+    reader = User.objects.order_by('-counters__following_count').first()
+    group_id = Group.objects.values_list('pk', flat=True).first() or 0
+    post_id = Post.objects.values_list('pk', flat=True).first() or 0
+    author_id = author.pk if author else 0
+    reader_id = reader.pk if reader else 0
+    queries = {
+        'index': Post.objects.feed()[:NUM + 1],
+        'group_posts': Post.objects.feed().filter(
+            group_id=group_id)[:NUM + 1],
+        'profile': Post.objects.feed().filter(
+            author_id=author_id)[:NUM + 1],
+        'comments': Comment.objects.filter(
+            post_id=post_id).select_related('author'),
+        'followers': Follow.objects.filter(
+            author_id=author_id).values_list('user_id', flat=True),
+        'following': Follow.objects.filter(
+            user_id=reader_id).values_list('author_id', flat=True),
+        'is_following': Follow.objects.filter(
+            user_id=reader_id, author_id=author_id).values('pk')[:1],
+    }
+    if reader is not None:
+        # Каждый источник ленты подписок читается своим запросом.
+        for number, source in enumerate(Timeline(reader_id).sources()):
+            name = 'follow_index' if not number else f'follow_pull_{number}'
+            queries[name] = source[:NUM + 1]
+    return queries
+
+
+class Command(BaseCommand):
+    help = 'Печатает планы горячих запросов ленты, чтобы проверить индексы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Какие запросы показать')
+        parser.add_argument(
+            '--sql', action='store_true', help='Печатать и сам SQL')
+
+    def handle(self, *args, **options):
+        queries = hot_queries()
+        unknown = set(options['names']) - set(queries)
+        if unknown:
+            raise CommandError(
+                f'Неизвестные запросы: {", ".join(sorted(unknown))}; '
+                f'есть {", ".join(queries)}')
+        for name in options['names'] or queries:
+            queryset = queries[name]
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            if options['sql']:
+                self.stdout.write(str(queryset.query))
+            plan = queryset.explain()
+            style = (self.style.WARNING if WARNING.search(plan)
+                     else self.style.SUCCESS)
+            self.stdout.write(style(plan))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import export
+
+
+class Command(BaseCommand):
+    help = 'Потоково выгружает посты, комментарии, подписки и группы'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'tables', nargs='*',
+            help=f'Из {", ".join(export.TABLES)}; по умолчанию все')
+        parser.add_argument(
+            '--format', choices=export.FORMATS, default='ndjson')
+        parser.add_argument(
+            '--since', help='Только строки, изменённые с этого момента')
+        parser.add_argument('--output', help='Файл; по умолчанию stdout')
+
+    def handle(self, *args, **options):
+        tables = options['tables'] or list(export.TABLES)
+        unknown = set(tables) - set(export.TABLES)
+        if unknown:
+            raise CommandError(f'Неизвестные таблицы: {", ".join(unknown)}')
+        try:
+            since = None
+            if options['since']:
+                since = export.parse_since(options['since'])
+            lines = export.stream(tables, options['format'], since)
+        except ValueError as error:
+            raise CommandError(error)
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['output'], 'w', newline='') as output:
+            output.writelines(lines)
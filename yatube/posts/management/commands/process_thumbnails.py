@@ -0,0 +1,50 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from posts import thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Генерирует миниатюры картинок из очереди заданий'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--batch', type=int, default=20)
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='Пауза при пустой очереди, секунд')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Разобрать очередь и завершиться')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            while True:
+                jobs = thumbnails.claim(options['batch'])
+                if jobs:
+                    if pool is None:
+                        results = map(thumbnails.process, jobs)
+                    else:
+                        results = pool.map(self.process_in_thread, jobs)
+                    done = sum(results)
+                    self.stdout.write(f'Обработано {done} из {len(jobs)}')
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['interval'])
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    @staticmethod
+    def process_in_thread(job):
+        close_old_connections()
+        try:
+            return thumbnails.process(job)
+        finally:
+            connection.close()
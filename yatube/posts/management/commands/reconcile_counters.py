@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики постов, комментариев и подписчиков'
+
+    def handle(self, *args, **options):
+        for model_name, fixed in reconcile().items():
+            self.stdout.write(f'{model_name}: исправлено строк {fixed}')
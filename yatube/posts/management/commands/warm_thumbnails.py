@@ -0,0 +1,78 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts import thumbnails
+from posts.models import Post
+
+
+def lower_priority():
+    # Прогрев идёт рядом с живым трафиком и не должен отнимать у него CPU.
+    os.nice(10)
+
+
+class Command(BaseCommand):
+    help = 'Заранее генерирует миниатюры для всех картинок постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--batch', type=int, default=100)
+        parser.add_argument(
+            '--start-after', type=int, default=0,
+            help='Продолжить с поста, следующего за этим pk')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересоздать записи для уже прогретых картинок')
+
+    def batches(self, posts, size):
+        batch = []
+        for row in posts.iterator(chunk_size=size):
+            batch.append(row)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def handle(self, *args, **options):
+        posts = (
+            Post.objects.filter(pk__gt=options['start_after'])
+            .exclude(image='')
+            .order_by('pk')
+            .values_list('pk', 'image')
+        )
+        total = posts.count()
+        workers = options['workers']
+        pool = None
+        if workers > 1:
+            # Дочерние процессы не должны наследовать соединения с БД.
+            connections.close_all()
+            pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=get_context('fork'),
+                initializer=lower_priority)
+        done = skipped = 0
+        started = time.monotonic()
+        try:
+            for batch in self.batches(posts, options['batch']):
+                names = list(dict.fromkeys(name for _, name in batch))
+                if not options['force']:
+                    names = [
+                        name for name in names
+                        if not thumbnails.is_warm(name)]
+                skipped += len(batch) - len(names)
+                render = pool.map if pool is not None else map
+                thumbnails.store(render(thumbnails.render, names))
+                done += len(batch)
+                rate = done / max(time.monotonic() - started, 1e-6)
+                self.stdout.write(
+                    f'{done}/{total}, пропущено {skipped}, '
+                    f'{rate:.1f} постов/с, последний pk {batch[-1][0]}')
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {done} постов за {time.monotonic() - started:.1f} с'))
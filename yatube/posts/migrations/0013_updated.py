@@ -0,0 +1,41 @@
+from django.db import migrations, models
+import django.utils.timezone
+import posts.search
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_postsearch'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            migrations.RunPython.noop, posts.search.create_triggers),
+        migrations.AddField(
+            model_name='comment',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='follow',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(
+            posts.search.create_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+import re
+
+from django.db import connection
+from django.db.models import (Case, F, FloatField, IntegerField, Q,
+                              Subquery, When)
+from django.db.models.functions import Coalesce
+
+from .models import Post, PostSearch
+
+WORD = re.compile(r'\w+')
+# Ранжируются только столько последних совпадений: bm25 по сотням тысяч
+# строк для частых слов занимает секунды. Более старые совпадения идут
+# следом по дате, без ранжирования.
+SEARCH_WINDOW = 1000
+
+# SQLite пересоздаёт таблицу при AddField/AlterField и теряет триггеры:
+# такие миграции posts_post должны вызывать create_triggers.
+TRIGGERS = (
+    "CREATE TRIGGER IF NOT EXISTS posts_post_fts_insert "
+    "AFTER INSERT ON posts_post BEGIN "
+    "INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS posts_post_fts_delete "
+    "AFTER DELETE ON posts_post BEGIN "
+    "INSERT INTO posts_post_fts(posts_post_fts, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS posts_post_fts_update "
+    "AFTER UPDATE OF text ON posts_post BEGIN "
+    "INSERT INTO posts_post_fts(posts_post_fts, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text); "
+    "END",
+)
+
+
+def create_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in TRIGGERS:
+        schema_editor.execute(statement)
+    # Строки, изменённые без триггеров, индекс подхватит при перестройке.
+    schema_editor.execute(
+        "INSERT INTO posts_post_fts(posts_post_fts) VALUES ('rebuild')")
+
+
+def match_expression(query):
+    """Превращает ввод пользователя в безопасный запрос FTS5.
+
+    Каждое слово берётся в кавычки и ищется по префиксу, все слова
+    должны встретиться в тексте.
+    """
+    return ' '.join(f'"{word}"*' for word in WORD.findall(query))
+
+
+def search_posts(query, queryset=None):
+    if queryset is None:
+        queryset = Post.objects.all()
+    expression = match_expression(query)
+    if not expression:
+        return queryset.none()
+    if connection.vendor != 'sqlite':
+        for word in WORD.findall(query):
+            queryset = queryset.filter(text__icontains=word)
+        return queryset.order_by('-pub_date')
+    oldest = PostSearch.objects.filter(text__match=expression).order_by(
+        '-post_id').values('post_id')[SEARCH_WINDOW - 1:SEARCH_WINDOW]
+    in_window = Q(pk__gte=Coalesce(Subquery(oldest), 0))
+    # CASE считает rank только для строк окна.
+    return queryset.filter(search__text__match=expression).order_by(
+        Case(When(in_window, then=0), default=1,
+             output_field=IntegerField()),
+        Case(When(in_window, then=F('search__rank')),
+             output_field=FloatField()),
+        '-pub_date')
@@ -0,0 +1,185 @@
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from core.cache import bump_version
+
+from . import cards, counters, feeds, following, thumbnails, timeline
+from .models import Comment, Follow, Group, Post, User, UserCounters
+
+
+@receiver(post_save, sender=User)
+def create_counters(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserCounters.objects.get_or_create(user=instance)
+
+
+def is_rename(created, raw, update_fields):
+    # Вход сохраняет только last_login, имя при этом не меняется.
+    return not (created or raw or (
+        update_fields and not {
+            'username', 'first_name', 'last_name'} & set(update_fields)))
+
+
+@receiver(post_save, sender=User)
+def forget_author_cards(sender, instance, created, update_fields=None,
+                        raw=False, **kwargs):
+    if is_rename(created, raw, update_fields):
+        cards.forget_author(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_feeds(sender, instance, created, update_fields=None,
+                            raw=False, **kwargs):
+    if not is_rename(created, raw, update_fields):
+        return
+    feeds.invalidate_author(
+        instance.pk,
+        Post.objects.filter(author=instance).values_list(
+            'group_id', flat=True).distinct(),
+        Comment.objects.filter(author=instance).values_list(
+            'post_id', flat=True).distinct())
+
+
+@receiver(pre_save, sender=Post)
+def remember_relations(sender, instance, **kwargs):
+    instance._previous_group_id = instance._previous_author_id = None
+    instance._previous_image = ''
+    if instance.pk is not None:
+        previous = Post.objects.filter(pk=instance.pk).values_list(
+            'group_id', 'author_id', 'image').first()
+        if previous is not None:
+            (instance._previous_group_id,
+             instance._previous_author_id,
+             instance._previous_image) = previous
+
+
+@receiver(post_save, sender=Post)
+def count_post(sender, instance, created, **kwargs):
+    with transaction.atomic():
+        if created:
+            counters.change_user(instance.author_id, posts_count=1)
+            counters.change_group(instance.group_id, posts_count=1)
+            return
+        if instance._previous_author_id not in (None, instance.author_id):
+            counters.change_user(instance._previous_author_id, posts_count=-1)
+            counters.change_user(instance.author_id, posts_count=1)
+        if instance._previous_group_id != instance.group_id:
+            counters.change_group(instance._previous_group_id, posts_count=-1)
+            counters.change_group(instance.group_id, posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def uncount_post(sender, instance, **kwargs):
+    with transaction.atomic():
+        counters.change_user(instance.author_id, posts_count=-1)
+        counters.change_group(instance.group_id, posts_count=-1)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    if created:
+        timeline.fan_out(instance)
+
+
+@receiver(post_save, sender=Post)
+def queue_thumbnails(sender, instance, **kwargs):
+    if instance.image and instance.image.name != instance._previous_image:
+        thumbnails.enqueue(instance.image.name)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_feeds(sender, instance, **kwargs):
+    feeds.invalidate_post(
+        instance, getattr(instance, '_previous_group_id', None))
+
+
+@receiver(post_save, sender=Post)
+def render_post_cards(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # Старая карточка не должна пережить откат или дожить до коммита.
+    cards.forget([instance.pk])
+    transaction.on_commit(lambda: cards.refresh([instance]))
+
+
+@receiver(post_delete, sender=Post)
+def forget_post_cards(sender, instance, **kwargs):
+    cards.forget([instance.pk])
+
+
+@receiver(post_save, sender=Group)
+def forget_group_cards(sender, instance, created, raw=False, **kwargs):
+    # В карточке есть ссылка по slug группы.
+    if not created and not raw:
+        cards.forget_group(instance.pk)
+
+
+@receiver(pre_delete, sender=Group)
+def forget_deleted_group_cards(sender, instance, **kwargs):
+    # После удаления group_id постов уже NULL, их не найти по группе.
+    post_ids = list(Post.objects.filter(
+        group_id=instance.pk).values_list('pk', flat=True))
+    cards.forget(post_ids)
+    transaction.on_commit(lambda: cards.forget(post_ids))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group_feeds(sender, instance, **kwargs):
+    feeds.invalidate_group(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created and instance.post_id is not None:
+        counters.change_post(instance.post_id, comments_count=1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    if instance.post_id is not None:
+        counters.change_post(instance.post_id, comments_count=-1)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_post(sender, instance, **kwargs):
+    if instance.post_id is not None:
+        bump_version(feeds.post_key(instance.post_id))
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, **kwargs):
+    if created:
+        with transaction.atomic():
+            counters.change_user(instance.author_id, followers_count=1)
+            counters.change_user(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def uncount_follow(sender, instance, **kwargs):
+    with transaction.atomic():
+        counters.change_user(instance.author_id, followers_count=-1)
+        counters.change_user(instance.user_id, following_count=-1)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created:
+        timeline.mark_pulled(instance.author_id)
+        timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def trim_timeline(sender, instance, **kwargs):
+    timeline.trim(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_feed(sender, instance, **kwargs):
+    bump_version(feeds.user_follow_feed(instance.user_id))
+    following.forget(instance.user_id)
@@ -0,0 +1,12 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from posts import cards
+
+register = template.Library()
+
+
+@register.filter
+def post_cards(posts, variant):
+    """Карточки постов: {% for card in page_obj|post_cards:'index' %}"""
+    return [mark_safe(card) for card in cards.get_cards(list(posts), variant)]
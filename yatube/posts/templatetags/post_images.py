@@ -0,0 +1,10 @@
+from django import template
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def ready_thumbnail(file_, geometry, **options):
+    return thumbnails.ready_thumbnail(file_, geometry, **options)
@@ -1,7 +1,10 @@
+from io import StringIO
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
 
-from ..models import Group, Post
+from ..models import Comment, Follow, Group, Post, UserCounters
 
 User = get_user_model()
 
@@ -29,3 +32,83 @@ class PostModelTest(TestCase):
         group = PostModelTest.group
         expected_object_name = group.title
         self.assertEqual(expected_object_name, str(group))
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='author')
+        self.follower = User.objects.create_user(username='follower')
+        self.group = Group.objects.create(title='Группа', slug='group')
+        self.post = Post.objects.create(
+            author=self.user, group=self.group, text='Пост')
+
+    def assertCounters(self, user, **expected):
+        counters = UserCounters.objects.get(user=user)
+        for field, value in expected.items():
+            with self.subTest(field=field):
+                self.assertEqual(getattr(counters, field), value)
+
+    def test_counters_follow_writes(self):
+        Comment.objects.create(post=self.post, author=self.user, text='К')
+        Follow.objects.create(user=self.follower, author=self.user)
+        self.post.refresh_from_db()
+        self.group.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        self.assertEqual(self.group.posts_count, 1)
+        self.assertCounters(self.user, posts_count=1, followers_count=1)
+        self.assertCounters(self.follower, following_count=1)
+        self.post.delete()
+        Follow.objects.all().delete()
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 0)
+        self.assertCounters(self.user, posts_count=0, followers_count=0)
+        self.assertCounters(self.follower, following_count=0)
+
+    def test_group_change_moves_count(self):
+        other = Group.objects.create(title='Другая', slug='other')
+        self.post.group = other
+        self.post.save()
+        self.group.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 0)
+        self.assertEqual(other.posts_count, 1)
+
+    def test_save_does_not_overwrite_counters(self):
+        stale = Post.objects.get(pk=self.post.pk)
+        Comment.objects.create(post=self.post, author=self.user, text='К')
+        stale.text = 'Изменённый пост'
+        stale.save()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+
+    def test_reconcile_counters(self):
+        UserCounters.objects.update(posts_count=42)
+        Group.objects.update(posts_count=0)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 1)
+        self.assertCounters(self.user, posts_count=1)
+        self.assertCounters(self.follower, posts_count=0)
+
+
+class FeedIndexesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='author')
+        reader = User.objects.create_user(username='reader')
+        group = Group.objects.create(title='Группа', slug='group')
+        post = Post.objects.create(author=author, group=group, text='Пост')
+        Comment.objects.create(post=post, author=reader, text='Коммент')
+        Follow.objects.create(user=reader, author=author)
+
+    def test_hot_queries_use_composite_indexes(self):
+        output = StringIO()
+        call_command('explain_hot_queries', 'group_posts', 'profile',
+                     'comments', 'followers', 'follow_index', stdout=output)
+        plans = output.getvalue()
+        for index in ('post_group_date_idx', 'post_author_date_idx',
+                      'comment_post_created_idx', 'follow_author_user_idx',
+                      'timeline_user_date_idx'):
+            with self.subTest(index=index):
+                self.assertIn(index, plans)
+        self.assertNotIn('TEMP B-TREE', plans)
@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+import time
+from multiprocessing import get_context
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from core.cache import LOCK_KEY, expires_early, get_or_refresh
+from core.cache_backends import SQLiteCache
+from posts.models import Post, User
+from posts.utils import LazyCountPaginator
+
+POSTS_TOTAL = 13
+
+
+class LazyCountPaginatorTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        Post.objects.bulk_create(
+            Post(author=cls.user, text=f'Пост {i}')
+            for i in range(POSTS_TOTAL))
+
+    def setUp(self):
+        cache.clear()
+
+    def count_queries(self, queries):
+        return sum('COUNT(' in query['sql'] for query in queries)
+
+    def test_has_next_without_count(self):
+        paginator = LazyCountPaginator(Post.objects.all(), 10, count_ttl=None)
+        with CaptureQueriesContext(connection) as queries:
+            page = paginator.get_page(1)
+            self.assertEqual(len(page), 10)
+            self.assertTrue(page.has_next())
+            self.assertIsNone(paginator.count)
+        self.assertEqual(self.count_queries(queries), 0)
+        self.assertEqual(len(queries), 1)
+
+    def test_last_page_count_is_exact(self):
+        paginator = LazyCountPaginator(Post.objects.all(), 10, count_ttl=None)
+        page = paginator.get_page(2)
+        self.assertEqual(len(page), POSTS_TOTAL - 10)
+        self.assertFalse(page.has_next())
+        self.assertEqual(paginator.count, POSTS_TOTAL)
+        self.assertEqual(paginator.num_pages, 2)
+
+    def test_estimated_count_is_cached(self):
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(2):
+                paginator = LazyCountPaginator(Post.objects.all(), 5)
+                paginator.get_page(1)
+                self.assertEqual(list(paginator.page_range), [1, 2, 3])
+        self.assertEqual(self.count_queries(queries), 1)
+
+    def test_out_of_range_page_falls_back_to_first(self):
+        paginator = LazyCountPaginator(Post.objects.all(), 10)
+        self.assertEqual(paginator.get_page(100).number, 1)
+        self.assertEqual(paginator.get_page('abc').number, 1)
+
+
+class GetOrRefreshTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return f'значение {self.calls}'
+
+    def test_expires_early_near_deadline(self):
+        now = time.time()
+        self.assertFalse(expires_early(now + 60, delta=0))
+        self.assertTrue(expires_early(now - 1, delta=0))
+        with mock.patch('core.cache.random.random', return_value=0.9999):
+            self.assertTrue(expires_early(now + 5, delta=1))
+
+    def test_only_lock_holder_recomputes(self):
+        self.assertEqual(
+            get_or_refresh('key', 1, self.compute, 60), 'значение 1')
+        self.assertEqual(
+            get_or_refresh('key', 1, self.compute, 60), 'значение 1')
+        cache.add(LOCK_KEY.format('key'), 1)
+        self.assertEqual(
+            get_or_refresh('key', 2, self.compute, 60), 'значение 1')
+        cache.delete(LOCK_KEY.format('key'))
+        self.assertEqual(
+            get_or_refresh('key', 2, self.compute, 60), 'значение 2')
+        self.assertIsNone(cache.get(LOCK_KEY.format('key')))
+
+
+def increment(location):
+    cache = SQLiteCache(location, {})
+    for _ in range(200):
+        cache.incr('counter')
+
+
+class SQLiteCacheTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = SQLiteCache(
+            self.location, {'OPTIONS': {'MAX_ENTRIES': 10}})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_values_survive_round_trip(self):
+        self.cache.set_many({'int': 5, 'flag': True, 'page': ('<p>', {})})
+        self.assertEqual(
+            self.cache.get_many(['int', 'flag', 'page', 'missing']),
+            {'int': 5, 'flag': True, 'page': ('<p>', {})})
+        self.assertIs(self.cache.get('flag'), True)
+
+    def test_add_takes_only_missing_or_expired_key(self):
+        self.assertTrue(self.cache.add('lock', 1))
+        self.assertFalse(self.cache.add('lock', 2))
+        self.cache.set('lock', 1, timeout=-1)
+        self.assertIsNone(self.cache.get('lock'))
+        self.assertTrue(self.cache.add('lock', 3))
+        self.assertEqual(self.cache.get('lock'), 3)
+
+    def test_incr_is_atomic_across_processes(self):
+        self.cache.set('counter', 0)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+        with get_context('fork').Pool(4) as pool:
+            pool.map(increment, [self.location] * 4)
+        self.assertEqual(self.cache.get('counter'), 800)
+
+    def test_cull_evicts_least_recently_read(self):
+        self.cache.set('hot', 1)
+        with mock.patch('core.cache_backends.random.random', return_value=0), \
+                mock.patch('core.cache_backends.ACCESS_RESOLUTION', 0):
+            for i in range(20):
+                self.cache.set(f'key{i}', i)
+                self.cache.get('hot')
+        self.assertEqual(self.cache.get('hot'), 1)
+        self.assertLessEqual(
+            len(self.cache.get_many([f'key{i}' for i in range(20)])), 10)
+
+
+class SQLitePragmasTest(TestCase):
+    def test_new_connections_get_pragmas(self):
+        copy = connection.copy()
+        try:
+            with override_settings(SQLITE_PRAGMAS={'busy_timeout': 1234}):
+                copy.ensure_connection()
+            timeout = copy.connection.execute(
+                'PRAGMA busy_timeout').fetchone()[0]
+        finally:
+            copy.connection.close()
+        self.assertEqual(timeout, 1234)
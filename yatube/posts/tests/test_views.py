@@ -1,15 +1,32 @@
+import json
+import os
 import shutil
 import tempfile
+from io import StringIO
+from unittest import mock
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from posts.models import Follow, Group, Post, User
+from core import template_backends, timing
+from core.cache import LOCK_KEY
+from core.routers import STICKY_COOKIE
+from posts import benchmark, cards, feeds, following, thumbnails
+from posts.comments import FIRST_PAGE_KEY
+from posts.utils import COMMENTS_NUM, CURSOR_FROM_PAGE, NUM
+from posts.models import (Comment, Follow, Group, Post, ThumbnailJob,
+                          TimelineEntry, User)
+from posts.search import search_posts
 
 User = get_user_model()
 
@@ -128,6 +145,44 @@ class PostURLTests(TestCase):
         self.assertEqual(post_text, self.post.text)
         self.assertEqual(post_group, Group.objects.get(slug=self.group.slug))
 
+    def test_thumbnails_are_generated_in_background(self):
+        cache.clear()
+        self.assertTrue(
+            ThumbnailJob.objects.filter(name=self.post.image.name).exists())
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Изображение обрабатывается')
+        call_command(
+            'process_thumbnails', '--once', '--workers=1', stdout=StringIO())
+        self.assertFalse(ThumbnailJob.objects.exists())
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertNotContains(response, 'Изображение обрабатывается')
+        self.assertContains(response, '<img class="card-img my-2"')
+
+    def test_missing_source_is_not_requeued(self):
+        cache.clear()
+        post = Post.objects.create(
+            author=self.user, text='Без файла', image='posts/missing.gif')
+        thumbnails.enqueue(post.image.name)
+        call_command(
+            'process_thumbnails', '--once', '--workers=1', stdout=StringIO())
+        job = ThumbnailJob.objects.get(name=post.image.name)
+        self.assertEqual(job.attempts, thumbnails.MAX_ATTEMPTS)
+        url = reverse('posts:post_detail', args=(post.pk,))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse(any(
+            'posts_thumbnailjob' in query['sql'] for query in queries))
+
+    def test_warm_thumbnails_fills_kvstore(self):
+        cache.clear()
+        self.assertFalse(thumbnails.is_warm(self.post.image.name))
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Изображение обрабатывается')
+        call_command('warm_thumbnails', '--workers=1', stdout=StringIO())
+        self.assertTrue(thumbnails.is_warm(self.post.image.name))
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, '<img class="card-img my-2"')
+
     def test_post_edit_show_correct_context(self):
         response = self.authorized_client.get(
             reverse('posts:post_edit',
@@ -190,16 +245,28 @@ class PostURLTests(TestCase):
     def test_cache(self):
         response_1 = self.authorized_client.get(reverse('posts:index'))
         content_1 = response_1.content
-        Post.objects.all().delete
+        Post.objects.filter(pk=self.post.pk).update(text='Изменённый текст')
         response_2 = self.authorized_client.get(reverse('posts:index'))
         content_2 = response_2.content
         self.assertEqual(content_1, content_2)
-        Post.objects.all().delete
         cache.clear()
         response_3 = self.authorized_client.get(reverse('posts:index'))
         content_3 = response_3.content
         self.assertNotEqual(content_1, content_3)
 
+    def test_cache_invalidated_on_post_save(self):
+        self.authorized_client.get(reverse('posts:index'))
+        self.authorized_client.get(
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}))
+        Post.objects.create(
+            author=self.user, group=self.group, text='Свежий пост')
+        for url in (reverse('posts:index'),
+                    reverse('posts:group_list',
+                            kwargs={'slug': self.group.slug})):
+            with self.subTest(url=url):
+                response = self.authorized_client.get(url)
+                self.assertContains(response, 'Свежий пост')
+
     def test_follow_page(self):
         response = self.authorized_client.get(reverse('posts:follow_index'))
         self.assertEqual(len(response.context['page_obj']), 0)
@@ -214,6 +281,762 @@ class PostURLTests(TestCase):
         self.assertEqual(len(response_3.context['page_obj']), 0)
 
 
+class FollowTimelineTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader')
+        self.author = User.objects.create_user(username='writer')
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def get_feed(self):
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'])
+
+    def test_new_post_is_fanned_out_to_followers(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(author=self.author, text='Новый пост')
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.user, post=post).exists())
+        self.assertEqual(self.get_feed(), [post])
+
+    def test_follow_backfills_and_unfollow_trims(self):
+        post = Post.objects.create(author=self.author, text='Старый пост')
+        self.authorized_client.get(reverse(
+            'posts:profile_follow', kwargs={'username': self.author}))
+        self.assertEqual(self.get_feed(), [post])
+        self.authorized_client.get(reverse(
+            'posts:profile_unfollow', kwargs={'username': self.author}))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user))
+        self.assertEqual(self.get_feed(), [])
+
+    @mock.patch('posts.timeline.FANOUT_LIMIT', 0)
+    def test_popular_author_posts_are_pulled(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(author=self.author, text='Популярный')
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.get_feed(), [post])
+
+    @mock.patch('posts.timeline.FANOUT_LIMIT', 1)
+    def test_author_stays_pulled_below_the_limit(self):
+        other = User.objects.create_user(username='other')
+        Follow.objects.create(user=self.user, author=self.author)
+        Follow.objects.create(user=other, author=self.author)
+        post = Post.objects.create(author=self.author, text='В режиме pull')
+        Follow.objects.filter(user=other).delete()
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.get_feed(), [post])
+        newer = Post.objects.create(author=self.author, text='После')
+        self.assertEqual(self.get_feed(), [newer, post])
+
+    def test_pushed_and_pulled_posts_are_merged_by_date(self):
+        star = User.objects.create_user(username='star')
+        Follow.objects.create(user=self.user, author=self.author)
+        with mock.patch('posts.timeline.FANOUT_LIMIT', 0):
+            Follow.objects.create(user=self.user, author=star)
+            pulled = [Post.objects.create(author=star, text=f'Звезда {i}')
+                      for i in range(NUM)]
+        pushed = [Post.objects.create(author=self.author, text=f'Пост {i}')
+                  for i in range(NUM)]
+        expected = sorted(
+            pulled + pushed, key=lambda post: (post.pub_date, post.pk),
+            reverse=True)
+        with mock.patch('posts.timeline.FANOUT_LIMIT', 0):
+            url = reverse('posts:follow_index')
+            first = self.authorized_client.get(
+                url, {'cursor': ''}).context['page_obj']
+            second = self.authorized_client.get(
+                url, {'cursor': first.next_cursor}).context['page_obj']
+            numbered = self.authorized_client.get(
+                url, {'page': 2}).context['page_obj']
+        self.assertEqual(list(first) + list(second), expected)
+        self.assertEqual(list(numbered), expected[NUM:])
+
+
+class SearchViewTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='writer')
+        self.client = Client()
+
+    def search(self, query):
+        response = self.client.get(reverse('posts:search'), {'q': query})
+        self.assertTemplateUsed(response, 'posts/search.html')
+        return list(response.context['page_obj'])
+
+    def test_results_are_ranked(self):
+        rare = Post.objects.create(
+            author=self.author, text='Длинный текст, где кошка одна')
+        often = Post.objects.create(
+            author=self.author, text='Кошка, кошка и ещё кошки')
+        Post.objects.create(author=self.author, text='Про собак')
+        self.assertEqual(self.search('кошк'), [often, rare])
+        self.assertEqual(self.search('кошка собак'), [])
+        self.assertEqual(self.search('" OR *'), [])
+
+    @mock.patch('posts.search.SEARCH_WINDOW', 2)
+    def test_only_latest_matches_are_ranked(self):
+        oldest, often, rare = (
+            Post.objects.create(author=self.author, text=text)
+            for text in ('Кошка, кошка, кошка', 'Кошка, кошка',
+                         'Длинный текст, где кошка одна'))
+        self.assertEqual(self.search('кошка'), [often, rare, oldest])
+        self.assertEqual(search_posts('кошка').count(), 3)
+
+    def test_index_follows_post_changes(self):
+        post = Post.objects.create(author=self.author, text='Морковь')
+        Post.objects.filter(pk=post.pk).update(text='Капуста')
+        self.assertEqual(self.search('морковь'), [])
+        self.assertEqual(self.search('капуста'), [post])
+        post.delete()
+        self.assertEqual(self.search('капуста'), [])
+
+
+class TimingMiddlewareTest(TestCase):
+    def setUp(self):
+        timing.reset()
+        self.staff = User.objects.create_user(username='admin', is_staff=True)
+        self.staff_client = Client()
+        self.staff_client.force_login(self.staff)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('posts:index'))
+        header = response['Server-Timing']
+        self.assertTrue(header.startswith('total;dur='))
+        self.assertIn('sql;dur=', header)
+        self.assertIn('template;dur=', header)
+
+    def test_stats_are_staff_only(self):
+        self.client.get(reverse('posts:index'))
+        url = reverse('core:timings')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        stats = self.staff_client.get(url).json()
+        self.assertEqual(stats['posts:index']['total']['count'], 1)
+        self.assertEqual(
+            set(stats['posts:index']['queries']),
+            {'count', 'p50', 'p95', 'p99'})
+
+
+QUERY_BUDGET = 8
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class TemplateProfilingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(TEMPLATE_PROFILING=True)
+    def test_every_template_and_include_is_timed(self):
+        response = self.client.get(reverse('posts:index'))
+        header = response['Server-Timing']
+        for name in ('posts/index.html x1', 'base.html x1',
+                     'includes/header.html x1', 'includes/paginator.html'):
+            with self.subTest(name=name):
+                self.assertIn(f'desc="{name}', header)
+
+    def test_profiling_is_off_by_default(self):
+        response = self.client.get(reverse('posts:index'))
+        self.assertNotIn('tpl;', response['Server-Timing'])
+
+    def test_warm_up_compiles_all_templates(self):
+        total = sum(
+            len(files) for _, _, files in os.walk(settings.TEMPLATES_DIR))
+        self.assertEqual(template_backends.warm_up(), total)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class BenchmarkTest(TestCase):
+    def test_every_page_is_measured(self):
+        targets = benchmark.seed(
+            users=5, groups=2, posts=15, comments=10, follows=10, images=1)
+        results = benchmark.run(targets, requests=3, concurrency=1)
+        self.assertEqual(set(results), {
+            'index', 'index_page_2', 'follow_index', 'profile',
+            'group_posts', 'post_detail', 'search', 'api_index',
+            'api_follow'})
+        for name, result in results.items():
+            with self.subTest(name=name):
+                self.assertEqual(result['requests'], 3)
+                self.assertLessEqual(result['queries'], QUERY_BUDGET)
+        self.assertEqual(benchmark.compare(results, results), [])
+        slower = {name: dict(result, p95=result['p95'] * 2, queries=0)
+                  for name, result in results.items()}
+        self.assertEqual(
+            len(benchmark.compare(slower, results)), len(results))
+        self.assertEqual(
+            len(benchmark.compare(results, slower)), len(results))
+
+
+class ImportPostsTest(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user(username='reader')
+        self.author = User.objects.create_user(username='writer')
+        self.group = Group.objects.create(title='Группа', slug='group')
+        Follow.objects.create(user=self.reader, author=self.author)
+
+    def test_import_csv(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as file:
+            file.write(
+                'text,author,group,pub_date\n'
+                'Первый,writer,group,2020-01-01T10:00:00\n'
+                'Второй,writer,,\n'
+                'Чужой,nobody,,\n')
+            file.flush()
+            call_command(
+                'import_posts', file.name, '--batch=1', stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 2)
+        first = Post.objects.get(text='Первый')
+        self.assertEqual(first.group, self.group)
+        self.assertEqual(first.pub_date.year, 2020)
+        self.assertEqual(TimelineEntry.objects.filter(
+            user=self.reader).count(), 2)
+        self.author.counters.refresh_from_db()
+        self.group.refresh_from_db()
+        self.assertEqual(self.author.counters.posts_count, 2)
+        self.assertEqual(self.group.posts_count, 1)
+
+    def test_malformed_jsonl_lines_are_skipped(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as file:
+            file.write('{"text": "one", "author": "writer"}\n'
+                       '{"text": "обрыв\n'
+                       '["text", "author"]\n'
+                       '{"text": "two", "author": "writer"}\n')
+            file.flush()
+            output = StringIO()
+            call_command('import_posts', file.name, stdout=output)
+        self.assertIn('неверный JSON', output.getvalue())
+        self.assertIn('строка не объект', output.getvalue())
+        self.assertCountEqual(
+            Post.objects.values_list('text', flat=True), ['one', 'two'])
+
+    def test_rows_with_missing_images_are_skipped(self):
+        rows = ('{"text": "Первый", "author": "writer", "image": "a.gif"}\n'
+                '{"text": "Второй", "author": "writer"}\n')
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as file, \
+                tempfile.TemporaryDirectory() as images:
+            file.write(rows)
+            file.flush()
+            output = StringIO()
+            call_command('import_posts', file.name, '--batch=1',
+                         stdout=output)
+            self.assertIn('картинка без --images-dir', output.getvalue())
+            call_command('import_posts', file.name, '--batch=1',
+                         f'--images-dir={images}', stdout=output)
+            self.assertIn('нет файла картинки', output.getvalue())
+            with self.assertRaises(CommandError):
+                call_command('import_posts', file.name,
+                             f'--images-dir={images}/missing')
+        self.assertEqual(
+            list(Post.objects.values_list('text', flat=True)),
+            ['Второй', 'Второй'])
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='admin', is_staff=True)
+        self.staff_client = Client()
+        self.staff_client.force_login(self.staff)
+        self.author = User.objects.create_user(username='writer')
+        self.posts = [
+            Post.objects.create(author=self.author, text=f'Пост {i}')
+            for i in range(3)]
+
+    def export(self, table, **params):
+        response = self.staff_client.get(
+            reverse('posts:export', kwargs={'table': table}), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    @mock.patch('posts.export.CHUNK_SIZE', 2)
+    def test_ndjson_is_streamed_in_windows(self):
+        lines = self.export('posts').splitlines()
+        self.assertEqual(
+            [json.loads(line)['id'] for line in lines],
+            [post.pk for post in self.posts])
+
+    def test_csv_and_incremental_export(self):
+        lines = self.export('posts', format='csv').splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['id', 'author_id'])
+        self.assertEqual(len(lines), 4)
+        since = timezone.now()
+        Post.objects.filter(pk=self.posts[0].pk).update(updated=since)
+        lines = self.export(
+            'posts', format='csv', since=since.isoformat()).splitlines()
+        self.assertEqual(len(lines), 2)
+
+    def test_counter_changes_reach_incremental_export(self):
+        since = timezone.now()
+        Comment.objects.create(
+            post=self.posts[1], author=self.author, text='Комментарий')
+        rows = [json.loads(line) for line in self.export(
+            'posts', since=since.isoformat()).splitlines()]
+        self.assertEqual([row['id'] for row in rows], [self.posts[1].pk])
+        self.assertEqual(rows[0]['comments_count'], 1)
+
+    def test_export_is_staff_only(self):
+        response = self.client.get(
+            reverse('posts:export', kwargs={'table': 'follows'}))
+        self.assertEqual(response.status_code, 302)
+
+    def test_command_exports_all_tables(self):
+        Follow.objects.create(user=self.staff, author=self.author)
+        output = StringIO()
+        call_command('export_data', stdout=output)
+        tables = [json.loads(line)['table']
+                  for line in output.getvalue().splitlines()]
+        self.assertEqual(tables.count('posts'), 3)
+        self.assertEqual(tables.count('follows'), 1)
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='writer')
+        self.post = Post.objects.create(author=self.author, text='Пост')
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.author)
+
+    def test_unchanged_pages_are_not_rendered(self):
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:profile', kwargs={'username': self.author}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                etag = response['ETag']
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                response = self.client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                self.assertEqual(response.status_code, 304)
+                Post.objects.create(author=self.author, text='Ещё пост')
+                self.post.save()
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+
+    def test_validator_depends_on_user(self):
+        url = reverse('posts:index')
+        anonymous = self.client.get(url)
+        response = self.authorized_client.get(
+            url, HTTP_IF_NONE_MATCH=anonymous['ETag'],
+            HTTP_IF_MODIFIED_SINCE=anonymous['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_new_comment_changes_post_etag(self):
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        etag = self.client.get(url)['ETag']
+        Comment.objects.create(
+            post=self.post, author=self.author, text='Комментарий')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def assertChanged(self, url, change, text):
+        etag = self.client.get(url)['ETag']
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, text)
+
+    def test_group_changes_reach_post_and_index(self):
+        group = Group.objects.create(title='Группа', slug='gslug')
+        self.post.group = group
+        self.post.save()
+
+        def rename():
+            group.title, group.slug = 'Новое имя', 'new-slug'
+            group.save()
+
+        self.assertChanged(
+            reverse('posts:post_detail', args=(self.post.pk,)), rename,
+            'Новое имя')
+        group.slug = 'third-slug'
+        self.assertChanged(reverse('posts:index'), group.save, 'third-slug')
+
+    def test_author_rename_changes_feeds(self):
+        commenter = User.objects.create_user(username='reader')
+        Comment.objects.create(
+            post=self.post, author=commenter, text='Комментарий')
+        renames = iter(('renamed1', 'renamed2'))
+
+        def rename(user):
+            def change():
+                user.username = next(renames)
+                user.save()
+            return change
+
+        self.assertChanged(reverse('posts:index'), rename(self.author),
+                           'renamed1')
+        self.assertChanged(
+            reverse('posts:post_detail', args=(self.post.pk,)),
+            rename(commenter), 'renamed2')
+
+
+class AnonymousPageCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='writer')
+        self.post = Post.objects.create(author=self.author, text='Первый')
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.author)
+        self.url = reverse('posts:index')
+
+    def test_anonymous_page_is_served_from_cache(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertContains(response, 'Первый')
+        Post.objects.create(author=self.author, text='Второй')
+        self.assertContains(self.client.get(self.url), 'Второй')
+
+    def test_stale_page_is_served_while_refreshing(self):
+        self.client.get(self.url)
+        Post.objects.create(author=self.author, text='Второй')
+        lock = LOCK_KEY.format(feeds.page_key(self.url))
+        cache.add(lock, 1)
+        response = self.client.get(self.url)
+        self.assertNotContains(response, 'Второй')
+        # С валидаторами новой версии клиент закрепил бы старую страницу.
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        cache.delete(lock)
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Второй')
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_stale_fragment_page_has_no_validators(self):
+        self.authorized_client.get(self.url)
+        Post.objects.create(author=self.author, text='Второй')
+        with mock.patch.object(cache, 'add', return_value=False):
+            response = self.authorized_client.get(self.url)
+        self.assertNotContains(response, 'Второй')
+        self.assertFalse(response.has_header('ETag'))
+        response = self.authorized_client.get(self.url)
+        self.assertContains(response, 'Второй')
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_logged_in_user_never_gets_cached_page(self):
+        self.client.get(self.url)
+        response = self.authorized_client.get(self.url)
+        self.assertContains(response, 'Пользователь: writer')
+        self.assertIsNotNone(response.context)
+
+
+class CommentsPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='writer')
+        self.client.force_login(self.author)
+        self.post = Post.objects.create(author=self.author, text='Пост')
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=self.author, text=f'Коммент {i}')
+            for i in range(COMMENTS_NUM + 5))
+        self.url = reverse('posts:post_detail', args=(self.post.pk,))
+        self.json_url = reverse('posts:post_comments', args=(self.post.pk,))
+
+    def test_first_page_and_json_continuation(self):
+        comments = self.client.get(self.url).context['comments']
+        self.assertEqual(len(comments), COMMENTS_NUM)
+        self.assertTrue(comments.has_next())
+        data = self.client.get(
+            self.json_url, {'cursor': comments.next_cursor}).json()
+        self.assertEqual(len(data['comments']), 5)
+        self.assertIsNone(data['next'])
+        seen = {comment.pk for comment in comments}
+        seen |= {comment['id'] for comment in data['comments']}
+        self.assertEqual(len(seen), COMMENTS_NUM + 5)
+        self.assertEqual(data['comments'][0]['author'], 'writer')
+
+    def test_first_page_is_cached_until_new_comment(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.assertFalse(any(
+            'posts_comment' in query['sql'] for query in queries))
+        self.client.post(
+            reverse('posts:add_comment', args=(self.post.pk,)),
+            {'text': 'Свежий'})
+        comments = self.client.get(self.url).context['comments']
+        self.assertEqual(comments[0].text, 'Свежий')
+
+    def test_cached_page_keeps_only_author_username(self):
+        self.client.get(self.url)
+        *_, (rows, next_cursor) = cache.get(
+            FIRST_PAGE_KEY.format(self.post.pk))
+        self.assertEqual(rows[0].author.username, 'writer')
+        for field in ('password', 'email'):
+            with self.subTest(field=field):
+                self.assertNotIn(field, rows[0].author.__dict__)
+
+    def test_json_for_missing_post(self):
+        url = reverse('posts:post_comments', args=(self.post.pk + 1,))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class FeedApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username='reader')
+        self.author = User.objects.create_user(username='writer')
+        self.group = Group.objects.create(title='Группа', slug='group')
+        Follow.objects.create(user=self.reader, author=self.author)
+        for i in range(NUM + 2):
+            Post.objects.create(
+                author=self.author, group=self.group, text=f'Пост {i}')
+
+    def test_cursor_pages_cover_feed(self):
+        url = reverse('posts:api_index')
+        first = self.client.get(url).json()
+        self.assertEqual(len(first['results']), NUM)
+        self.assertIsNone(first['previous'])
+        second = self.client.get(url, {'cursor': first['next']}).json()
+        self.assertEqual(len(second['results']), 2)
+        self.assertIsNone(second['next'])
+        ids = [post['id'] for post in first['results'] + second['results']]
+        self.assertEqual(
+            ids, list(Post.objects.values_list('pk', flat=True)))
+        self.assertEqual(first['results'][0], {
+            'id': ids[0], 'text': f'Пост {NUM + 1}',
+            'pub_date': first['results'][0]['pub_date'],
+            'author': 'writer', 'group': 'group', 'image': None,
+            'comments_count': 0})
+
+    def test_fields_selection(self):
+        response = self.client.get(
+            reverse('posts:api_group', args=(self.group.slug,)),
+            {'fields': 'id,author'})
+        self.assertEqual(
+            set(response.json()['results'][0]), {'id', 'author'})
+        response = self.client.get(
+            reverse('posts:api_profile', args=(self.author.username,)),
+            {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_follow_feed_needs_login(self):
+        url = reverse('posts:api_follow')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.client.force_login(self.reader)
+        self.assertEqual(len(self.client.get(url).json()['results']), NUM)
+
+
+class PostCardsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            username='writer', first_name='Лев', last_name='Толстой')
+        self.group = Group.objects.create(title='Группа', slug='group')
+        self.post = Post.objects.create(
+            author=self.author, group=self.group, text='Первая\nвторая')
+        self.key = cards.CARD_KEY.format('index', self.post.pk)
+
+    def test_feed_is_built_from_stored_cards(self):
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'Первая<br>вторая')
+        self.assertIn('Лев Толстой', cache.get(self.key))
+        cache.set(self.key, 'Готовая карточка')
+        feeds.invalidate_post(self.post)
+        self.assertContains(
+            self.client.get(reverse('posts:index')), 'Готовая карточка')
+
+    def test_author_and_group_changes_forget_cards(self):
+        self.client.get(reverse('posts:index'))
+        self.author.save(update_fields=['last_login'])
+        self.assertIsNotNone(cache.get(self.key))
+        self.author.first_name = 'Алексей'
+        self.author.save()
+        self.assertIsNone(cache.get(self.key))
+        self.client.get(reverse('posts:index'))
+        self.group.slug = 'renamed'
+        self.group.save()
+        self.assertIsNone(cache.get(self.key))
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'Алексей Толстой')
+        self.assertContains(
+            response, reverse('posts:group_list', args=('renamed',)))
+        self.post.text = 'Исправленный'
+        self.post.save()
+        self.assertContains(
+            self.client.get(reverse('posts:index')), 'Исправленный')
+
+    def test_deleted_group_is_not_linked(self):
+        link = reverse('posts:group_list', args=(self.group.slug,))
+        self.assertContains(self.client.get(reverse('posts:index')), link)
+        self.group.delete()
+        self.assertIsNone(cache.get(self.key))
+        self.assertNotContains(
+            self.client.get(reverse('posts:index')), link)
+
+
+class FollowStateTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='writer')
+        self.reader = User.objects.create_user(username='reader')
+        self.fan = User.objects.create_user(username='fan')
+        Follow.objects.create(user=self.fan, author=self.author)
+        self.client.force_login(self.reader)
+        self.url = reverse('posts:profile', args=(self.author.username,))
+
+    def test_button_depends_on_viewer(self):
+        response = self.client.get(self.url)
+        self.assertFalse(response.context['following'])
+        self.assertContains(response, 'Подписаться')
+        self.client.get(
+            reverse('posts:profile_follow', args=(self.author.username,)))
+        self.assertContains(self.client.get(self.url), 'Отписаться')
+        self.assertEqual(
+            following.followed_ids(self.reader.pk), {self.author.pk})
+        self.client.get(
+            reverse('posts:profile_unfollow', args=(self.author.username,)))
+        self.assertEqual(following.followed_ids(self.reader.pk), set())
+        self.assertFalse(self.client.get(self.url).context['following'])
+
+    def test_cached_state_skips_follow_table(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.assertFalse(any(
+            'posts_follow' in query['sql'] for query in queries))
+
+    def test_writes_ignore_stale_cached_set(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        cache.set(following.FOLLOWING_KEY.format(self.reader.pk), b'')
+        self.client.get(
+            reverse('posts:profile_unfollow', args=(self.author.username,)))
+        self.assertFalse(Follow.objects.filter(user=self.reader).exists())
+
+    def test_unfollow_without_follow(self):
+        response = self.client.get(
+            reverse('posts:profile_unfollow', args=(self.author.username,)))
+        self.assertRedirects(response, self.url)
+        self.assertTrue(Follow.objects.filter(author=self.author).exists())
+
+
+REPLICA = 'replica'
+
+
+def sync_replica():
+    """Копирует основную базу в реплику целиком, как репликация."""
+    for alias in ('default', REPLICA):
+        connections[alias].ensure_connection()
+    connections['default'].connection.backup(connections[REPLICA].connection)
+
+
+@override_settings(DATABASE_REPLICAS=[REPLICA])
+class ReplicaRouterTest(TransactionTestCase):
+    databases = {'default', REPLICA}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        connections.databases[REPLICA] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': f'{cls.directory}/replica.sqlite3',
+        }
+        connections.ensure_defaults(REPLICA)
+        connections.prepare_test_settings(REPLICA)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[REPLICA].close()
+        del connections.databases[REPLICA]
+        delattr(connections._connections, REPLICA)
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='writer')
+        self.post = Post.objects.create(author=self.author, text='Старый')
+        sync_replica()
+
+    def test_feed_reads_come_from_replica(self):
+        client = Client()
+        client.force_login(self.author)
+        Post.objects.create(author=self.author, text='Новый')
+        response = client.get(reverse('posts:api_index'))
+        self.assertContains(response, 'Старый')
+        self.assertNotContains(response, 'Новый')
+        sync_replica()
+        self.assertContains(client.get(reverse('posts:api_index')), 'Новый')
+
+    def test_shared_caches_are_filled_from_primary(self):
+        Post.objects.create(author=self.author, text='Новый')
+        self.assertContains(self.client.get(reverse('posts:index')), 'Новый')
+
+    def test_fragments_are_not_filled_from_replica(self):
+        client = Client()
+        client.force_login(self.author)
+        Post.objects.create(author=self.author, text='Новый')
+        client.get(reverse('posts:index'))
+        sync_replica()
+        self.assertContains(client.get(reverse('posts:index')), 'Новый')
+        self.assertContains(self.client.get(reverse('posts:index')), 'Новый')
+
+    def test_own_writes_are_read_from_primary(self):
+        client = Client()
+        client.force_login(self.author)
+        response = client.post(
+            reverse('posts:add_comment', args=(self.post.pk,)),
+            {'text': 'Мой комментарий'})
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        url = reverse('posts:post_detail', args=(self.post.pk,))
+        self.assertContains(client.get(url), 'Мой комментарий')
+        # Без липкой куки кэш комментариев всё равно заполняется из
+        # основной базы и не откатывается к реплике.
+        cache.clear()
+        del client.cookies[STICKY_COOKIE]
+        self.assertContains(client.get(url), 'Мой комментарий')
+        self.assertContains(self.client.get(url), 'Мой комментарий')
+
+
+class QueryBudgetTest(TestCase):
+    """Число запросов страницы не зависит от числа постов на ней."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader')
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        self.author = User.objects.create_user(username='writer')
+        self.group = Group.objects.create(title='Группа', slug='group')
+        self.post = self.create_post(self.author, self.group)
+        Follow.objects.create(user=self.user, author=self.author)
+
+    def create_post(self, author, group):
+        post = Post.objects.create(author=author, group=group, text='Пост')
+        Comment.objects.create(post=post, author=author, text='Комментарий')
+        return post
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.authorized_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_feed_queries_do_not_grow_with_page_size(self):
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.author}),
+            reverse('posts:follow_index'),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+        single = {url: self.count_queries(url) for url in urls}
+        for i in range(9):
+            author = User.objects.create_user(username=f'writer{i}')
+            Follow.objects.create(user=self.user, author=author)
+            Comment.objects.create(
+                post=self.post, author=author, text='Комментарий')
+            self.create_post(author, self.group)
+        Post.objects.filter(group=self.group).update(author=self.author)
+        for url in urls:
+            with self.subTest(url=url):
+                queries = self.count_queries(url)
+                self.assertEqual(queries, single[url])
+                self.assertLessEqual(queries, QUERY_BUDGET)
+
+
 PAGINATOR_DISPLAY = 13
 
 
@@ -264,3 +1087,47 @@ class PaginatorViewsTest(TestCase):
             reverse('posts:profile',
                     kwargs={'username': self.user}) + '?page=2')
         self.assertEqual(len(response.context['page_obj']), 3)
+
+    def test_deep_next_link_switches_to_cursor(self):
+        Post.objects.bulk_create(
+            Post(text=f'Ещё {i}', author=self.user)
+            for i in range(NUM * CURSOR_FROM_PAGE))
+        url = reverse('posts:index')
+        numbered = self.client.get(url, {'page': CURSOR_FROM_PAGE})
+        page = numbered.context['page_obj']
+        self.assertContains(numbered, f'?cursor={page.next_cursor}')
+        following = self.client.get(url, {'cursor': page.next_cursor})
+        self.assertEqual(
+            list(following.context['page_obj']),
+            list(self.client.get(
+                url, {'page': CURSOR_FROM_PAGE + 1}).context['page_obj']))
+        self.assertNotIn('next_cursor', vars(self.client.get(
+            url, {'page': CURSOR_FROM_PAGE - 1}).context['page_obj']))
+
+    def test_cursor_pages_index(self):
+        response = self.client.get(reverse('posts:index') + '?cursor=')
+        first_page = response.context['page_obj']
+        self.assertEqual(len(first_page), 10)
+        self.assertFalse(first_page.has_previous())
+        response = self.client.get(
+            reverse('posts:index') + f'?cursor={first_page.next_cursor}')
+        second_page = response.context['page_obj']
+        self.assertEqual(len(second_page), 3)
+        self.assertFalse(second_page.has_next())
+        self.assertFalse(set(first_page) & set(second_page))
+        response = self.client.get(
+            reverse('posts:index')
+            + f'?cursor={second_page.previous_cursor}')
+        self.assertEqual(
+            list(response.context['page_obj']), list(first_page))
+
+    def test_cached_pages_differ(self):
+        first = self.client.get(reverse('posts:index'))
+        second = self.client.get(reverse('posts:index') + '?page=2')
+        self.assertNotEqual(first.content, second.content)
+
+    def test_invalid_cursor_returns_first_page(self):
+        response = self.client.get(
+            reverse('posts:group_list', kwargs={'slug': self.group.slug})
+            + '?cursor=broken')
+        self.assertEqual(len(response.context['page_obj']), 10)
@@ -0,0 +1,216 @@
+import hashlib
+import logging
+
+from django.core.cache import cache
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings
+from sorl.thumbnail.helpers import serialize
+from sorl.thumbnail.images import (ImageFile, deserialize_image_file,
+                                   serialize_image_file)
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import \
+    KVStore as CachedDbKVStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core import timing
+from core.cache import bump_version
+
+from . import cards, feeds
+from .models import Post, ThumbnailJob
+
+logger = logging.getLogger(__name__)
+
+# Все размеры, в которых шаблоны показывают картинки постов.
+GEOMETRIES = (
+    ('400x443', {'crop': 'center', 'upscale': True}),
+    ('400x439', {'crop': 'center', 'upscale': True}),
+)
+MAX_ATTEMPTS = 3
+# Картинки, для которых миниатюр не будет: строка задания остаётся с
+# attempts = MAX_ATTEMPTS, а кэш избавляет страницы даже от её чтения.
+FAILED_KEY = 'thumbnail-failed:{}'
+FAILED_TIMEOUT = 24 * 60 * 60
+
+
+def thumbnail_options(source, options):
+    """Дополняет опции так же, как ThumbnailBackend.get_thumbnail."""
+    backend = default.backend
+    options = dict(options)
+    if settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(settings, attr)
+        if value != getattr(default_settings, attr):
+            options.setdefault(key, value)
+    return options
+
+
+def thumbnail_file(name, geometry, options):
+    source = ImageFile(name)
+    thumbnail_name = default.backend._get_thumbnail_filename(
+        source, geometry, thumbnail_options(source, options))
+    return ImageFile(thumbnail_name, default.storage)
+
+
+def enqueue(*names):
+    ThumbnailJob.objects.bulk_create(
+        [ThumbnailJob(name=name) for name in names if name],
+        ignore_conflicts=True)
+
+
+def failed_key(name):
+    return FAILED_KEY.format(hashlib.md5(name.encode()).hexdigest())
+
+
+def has_failed(name):
+    if cache.get(failed_key(name)):
+        return True
+    failed = ThumbnailJob.objects.filter(
+        name=name, attempts__gte=MAX_ATTEMPTS).exists()
+    if failed:
+        cache.set(failed_key(name), True, FAILED_TIMEOUT)
+    return failed
+
+
+def give_up(name):
+    ThumbnailJob.objects.update_or_create(
+        name=name, defaults={'attempts': MAX_ATTEMPTS})
+    cache.set(failed_key(name), True, FAILED_TIMEOUT)
+
+
+def ready_thumbnail(file_, geometry, **options):
+    """Готовая миниатюра или None; недостающая ставится в очередь."""
+    if not file_:
+        return None
+    name = getattr(file_, 'name', file_)
+    with timing.measure('thumbnail'):
+        thumbnail = default.kvstore.get(
+            thumbnail_file(name, geometry, options))
+        if thumbnail is None and not has_failed(name):
+            enqueue(name)
+    return thumbnail
+
+
+def generate(name):
+    for geometry, options in GEOMETRIES:
+        get_thumbnail(name, geometry, **options)
+    images_ready([name])
+
+
+def images_ready(names):
+    """Перерисовывает карточки постов с этими картинками, сбрасывает ленты."""
+    posts = list(Post.objects.feed().filter(image__in=names))
+    if not posts:
+        return
+    # Карточки с заглушкой «Изображение обрабатывается» больше не нужны.
+    cards.refresh(posts)
+    feeds.invalidate_posts(
+        {post.author_id for post in posts}, {post.group_id for post in posts})
+    bump_version(*(feeds.post_key(post.pk) for post in posts))
+
+
+def is_warm(name):
+    return all(
+        default.kvstore.get(thumbnail_file(name, geometry, options))
+        for geometry, options in GEOMETRIES)
+
+
+def render(name):
+    """Рисует все размеры без обращений к БД; годится для пула процессов.
+
+    Возвращает сериализованные исходник и миниатюры для store().
+    """
+    source = ImageFile(name)
+    if not source.exists():
+        return None
+    source_image = default.engine.get_image(source)
+    try:
+        source.set_size(default.engine.get_image_size(source_image))
+        rendered = []
+        for geometry, options in GEOMETRIES:
+            options = thumbnail_options(source, options)
+            thumbnail = ImageFile(
+                default.backend._get_thumbnail_filename(
+                    source, geometry, options),
+                default.storage)
+            if not thumbnail.exists():
+                options['image_info'] = default.engine.get_image_info(
+                    source_image)
+                default.backend._create_thumbnail(
+                    source_image, geometry, options, thumbnail)
+            else:
+                thumbnail.set_size()
+            rendered.append(serialize_image_file(thumbnail))
+        return serialize_image_file(source), rendered
+    finally:
+        default.engine.cleanup(source_image)
+
+
+def store(results):
+    """Записывает результаты render() в key-value store sorl пачкой."""
+    entries = {}
+    names = []
+    for source_raw, thumbnails_raw in filter(None, results):
+        source = deserialize_image_file(source_raw)
+        names.append(source.name)
+        entries[add_prefix(source.key)] = source_raw
+        keys = set(default.kvstore._get(
+            source.key, identity='thumbnails') or [])
+        for thumbnail_raw in thumbnails_raw:
+            thumbnail = deserialize_image_file(thumbnail_raw)
+            entries[add_prefix(thumbnail.key)] = thumbnail_raw
+            keys.add(thumbnail.key)
+        entries[add_prefix(source.key, 'thumbnails')] = serialize(list(keys))
+    if not entries:
+        return
+    _store_entries(entries)
+    images_ready(names)
+
+
+def _store_entries(entries):
+    kvstore = default.kvstore
+    if not isinstance(kvstore, CachedDbKVStore):
+        for key, value in entries.items():
+            kvstore._set_raw(key, value)
+        return
+    existing = dict(KVStoreModel.objects.filter(
+        key__in=list(entries)).values_list('key', 'value'))
+    KVStoreModel.objects.bulk_create(
+        [KVStoreModel(key=key, value=value)
+         for key, value in entries.items() if key not in existing],
+        ignore_conflicts=True)
+    for key, value in entries.items():
+        if key in existing and existing[key] != value:
+            KVStoreModel.objects.filter(key=key).update(value=value)
+    kvstore.cache.set_many(entries, settings.THUMBNAIL_CACHE_TIMEOUT)
+
+
+def claim(limit):
+    """Забирает задания из очереди; удаление строки служит блокировкой."""
+    jobs = []
+    pending = ThumbnailJob.objects.filter(attempts__lt=MAX_ATTEMPTS)
+    for job in pending[:limit]:
+        if ThumbnailJob.objects.filter(pk=job.pk).delete()[0]:
+            jobs.append(job)
+    return jobs
+
+
+def process(job):
+    try:
+        if not default.storage.exists(job.name):
+            logger.warning('Thumbnail source %s is missing', job.name)
+            give_up(job.name)
+            return False
+        generate(job.name)
+        return True
+    except Exception:
+        logger.exception('Thumbnail generation failed for %s', job.name)
+        if job.attempts + 1 < MAX_ATTEMPTS:
+            ThumbnailJob.objects.get_or_create(
+                name=job.name, defaults={'attempts': job.attempts + 1})
+        else:
+            give_up(job.name)
+        return False
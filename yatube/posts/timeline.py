@@ -0,0 +1,192 @@
+import heapq
+from itertools import islice
+
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from .models import Follow, Post, TimelineEntry, UserCounters
+from .utils import CursorPaginator, paginate_page
+
+# Посты авторов с большим числом подписчиков не раскладываются по лентам,
+# а подтягиваются при чтении.
+FANOUT_LIMIT = 1000
+BATCH_SIZE = 500
+
+
+def _insert(entries):
+    TimelineEntry.objects.bulk_create(
+        entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def is_pull_author(author_id):
+    return UserCounters.objects.filter(
+        user_id=author_id, pulled=True).exists()
+
+
+def mark_pulled(author_id):
+    """Делает автора «тянущим», когда подписчиков больше FANOUT_LIMIT.
+
+    Обратно автор не возвращается: посты, написанные в режиме pull, ни в
+    одну ленту не разложены, и без него подписчики бы их потеряли.
+    """
+    UserCounters.objects.filter(
+        user_id=author_id, followers_count__gt=FANOUT_LIMIT, pulled=False,
+    ).update(pulled=True)
+
+
+def fan_out(post):
+    if is_pull_author(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id).values_list('user_id', flat=True)
+    entries = []
+    for user_id in followers.iterator():
+        entries.append(TimelineEntry(
+            user_id=user_id, post_id=post.pk, pub_date=post.pub_date))
+        if len(entries) >= BATCH_SIZE:
+            _insert(entries)
+            entries = []
+    _insert(entries)
+
+
+def fan_out_batch(posts):
+    """Раскладывает пачку постов сразу: posts — объекты с pk и автором."""
+    author_ids = {post.author_id for post in posts}
+    pull_ids = set(UserCounters.objects.filter(
+        user_id__in=author_ids, pulled=True,
+    ).values_list('user_id', flat=True))
+    followers = {}
+    for author_id, user_id in Follow.objects.filter(
+            author_id__in=author_ids - pull_ids).values_list(
+                'author_id', 'user_id').iterator():
+        followers.setdefault(author_id, []).append(user_id)
+    entries = []
+    for post in posts:
+        for user_id in followers.get(post.author_id, ()):
+            entries.append(TimelineEntry(
+                user_id=user_id, post_id=post.pk, pub_date=post.pub_date))
+            if len(entries) >= BATCH_SIZE:
+                _insert(entries)
+                entries = []
+    _insert(entries)
+
+
+def backfill(user_id, author_id):
+    if is_pull_author(author_id):
+        return
+    posts = Post.objects.filter(
+        author_id=author_id).values_list('pk', 'pub_date')
+    entries = []
+    for post_id, pub_date in posts.iterator():
+        entries.append(TimelineEntry(
+            user_id=user_id, post_id=post_id, pub_date=pub_date))
+        if len(entries) >= BATCH_SIZE:
+            _insert(entries)
+            entries = []
+    _insert(entries)
+
+
+def trim(user_id, author_id):
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id).delete()
+
+
+def pull_author_ids(user_id):
+    return list(Follow.objects.filter(
+        user_id=user_id,
+        author__counters__pulled=True,
+    ).values_list('author_id', flat=True))
+
+
+def _unique(keys):
+    previous = None
+    for key in keys:
+        if key != previous:
+            yield key
+        previous = key
+
+
+class Timeline:
+    """Лента подписок пользователя как последовательность постов.
+
+    Ключи (pub_date, id) читаются диапазоном по индексу из TimelineEntry
+    и из постов каждого «тянущего» автора, но не дальше нужной страницы;
+    потоки сливаются, и только посты страницы загружаются целиком.
+    """
+
+    def __init__(self, user_id, posts=None):
+        self.user_id = user_id
+        self.posts = Post.objects.feed() if posts is None else posts
+
+    def values(self, *fields):
+        # В fields должен быть id: по нему посты сопоставляются с ключами.
+        return Timeline(self.user_id, Post.objects.values(*fields))
+
+    @cached_property
+    def pull_ids(self):
+        return pull_author_ids(self.user_id)
+
+    def sources(self, reverse=False):
+        order = '' if reverse else '-'
+        sources = [TimelineEntry.objects.filter(
+            user_id=self.user_id,
+        ).order_by(f'{order}pub_date', f'{order}post_id').values_list(
+            'pub_date', 'post_id')]
+        for author_id in self.pull_ids:
+            sources.append(Post.objects.filter(
+                author_id=author_id,
+            ).order_by(f'{order}pub_date', f'{order}id').values_list(
+                'pub_date', 'id'))
+        return sources
+
+    def keys(self, limit, position=None, reverse=False):
+        """Ключи постов ленты по порядку, не больше limit."""
+        heads = []
+        for queryset in self.sources(reverse):
+            if position is not None:
+                queryset = seek(queryset, position, reverse)
+            heads.append(list(queryset[:limit]))
+        if len(heads) == 1:
+            return heads[0]
+        merged = heapq.merge(*heads, reverse=not reverse)
+        return list(islice(_unique(merged), limit))
+
+    def load(self, keys):
+        ids = [pk for _, pk in keys]
+        found = {}
+        for row in self.posts.filter(pk__in=ids):
+            found[row['id'] if isinstance(row, dict) else row.pk] = row
+        return [found[pk] for pk in ids if pk in found]
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError('Ленту можно только срезать')
+        return self.load(self.keys(index.stop)[index.start or 0:])
+
+
+def seek(queryset, position, reverse):
+    """Ключи после курсора; id поста — второе поле values_list."""
+    id_field = queryset._fields[1]
+    value, pk = parse_datetime(position[0]), int(position[1])
+    if value is None:
+        raise ValueError('Неверная дата в курсоре')
+    if reverse:
+        return queryset.filter(pub_date__gte=value).exclude(
+            pub_date=value, **{f'{id_field}__lte': pk})
+    return queryset.filter(pub_date__lte=value).exclude(
+        pub_date=value, **{f'{id_field}__gte': pk})
+
+
+class TimelinePaginator(CursorPaginator):
+    """Курсоры по ленте подписок: ищет по ключам записей, а не по Post."""
+
+    def fetch(self, position, reverse):
+        timeline = self.object_list
+        return timeline.load(
+            timeline.keys(self.per_page + 1, position, reverse))
+
+
+def timeline_page(user, request):
+    # Число постов в ленте не считается: это слияние нескольких потоков.
+    return paginate_page(
+        Timeline(user.pk), request, TimelinePaginator, count_ttl=None)
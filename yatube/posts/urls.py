@@ -13,7 +13,18 @@ urlpatterns = [
     path('posts/<int:post_id>/edit/', views.post_edit, name='post_edit'),
     path(
         'posts/<int:post_id>/comment/', views.add_comment, name='add_comment'),
+    path(
+        'posts/<int:post_id>/comments/', views.post_comments,
+        name='post_comments'),
     path('follow/', views.follow_index, name='follow_index'),
+    path('search/', views.search, name='search'),
+    path('export/<slug:table>/', views.export_table, name='export'),
+    path('api/posts/', views.api_index, name='api_index'),
+    path('api/group/<slug:slug>/', views.api_group, name='api_group'),
+    path(
+        'api/profile/<str:username>/', views.api_profile,
+        name='api_profile'),
+    path('api/follow/', views.api_follow, name='api_follow'),
     path(
         'profile/<str:username>/follow/',
         views.profile_follow,
@@ -1,10 +1,223 @@
-from django.core.paginator import Paginator
+import base64
+import binascii
+import hashlib
+from math import ceil
+
+from django.core.cache import cache
+from django.core.paginator import (EmptyPage, Page, PageNotAnInteger,
+                                   Paginator)
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from core.routers import reading_primary
 
 NUM = 10
+COMMENTS_NUM = 20
+COUNT_TTL = 60
+# С этой страницы «Следующая» ведёт по курсору: OFFSET растёт с номером.
+CURSOR_FROM_PAGE = 3
+
+
+def encode_cursor(position, reverse=False):
+    raw = '|'.join((*position, 'p' if reverse else 'n'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None, False
+    *position, direction = raw.split('|')
+    if len(position) != 2 or direction not in ('n', 'p'):
+        return None, False
+    return position, direction == 'p'
+
+
+class CursorPage(Page):
+    is_cursor = True
+
+    def __init__(self, object_list, paginator,
+                 next_cursor=None, previous_cursor=None):
+        super().__init__(object_list, None, paginator)
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<Cursor page>'
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class CursorPaginator(Paginator):
+    """Keyset-пагинация: страница ищется по (pub_date, id), без OFFSET."""
+    date_field = 'pub_date'
+
+    def position(self, obj):
+        # Строки из values() приходят словарями.
+        if isinstance(obj, dict):
+            return (obj[self.date_field].isoformat(), str(obj['id']))
+        return (getattr(obj, self.date_field).isoformat(), str(obj.pk))
+
+    def seek(self, queryset, position, reverse):
+        value, pk = parse_datetime(position[0]), int(position[1])
+        if reverse:
+            return queryset.filter(
+                **{f'{self.date_field}__gte': value}
+            ).exclude(**{self.date_field: value, 'pk__lte': pk})
+        return queryset.filter(
+            **{f'{self.date_field}__lte': value}
+        ).exclude(**{self.date_field: value, 'pk__gte': pk})
+
+    def fetch(self, position, reverse):
+        """per_page + 1 строк после курсора в порядке выдачи."""
+        queryset = self.object_list
+        if position is not None:
+            queryset = self.seek(queryset, position, reverse)
+        ordering = (self.date_field, 'pk')
+        if not reverse:
+            ordering = tuple(f'-{field}' for field in ordering)
+        return list(queryset.order_by(*ordering)[:self.per_page + 1])
+
+    def page_from_cursor(self, cursor):
+        position, reverse = decode_cursor(cursor or '')
+        try:
+            rows = self.fetch(position, reverse)
+        except (TypeError, ValueError):
+            position, reverse = None, False
+            rows = self.fetch(None, False)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            if not has_more:
+                return self.page_from_cursor(None)
+            rows.reverse()
+        next_cursor = previous_cursor = None
+        if rows and (has_more or reverse):
+            next_cursor = encode_cursor(self.position(rows[-1]))
+        if rows and (position is not None):
+            previous_cursor = encode_cursor(
+                self.position(rows[0]), reverse=True)
+        return CursorPage(rows, self, next_cursor, previous_cursor)
+
+
+class CommentPaginator(CursorPaginator):
+    """Комментарии листаются по (created, id)."""
+    date_field = 'created'
+
+
+class LazyCountPaginator(Paginator):
+    """Не делает COUNT(*) на каждый запрос.
+
+    Наличие следующей страницы определяется по лишней (N+1) строке, а общее
+    число записей берётся из кэша, где оно хранится count_ttl секунд.
+    При count_ttl=None оценка отключена и шаблон показывает только
+    «Предыдущая»/«Следующая».
+    """
+
+    def __init__(self, object_list, per_page, count_ttl=COUNT_TTL, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_ttl = count_ttl
+        self.exact_count = None
+        self.loaded_number = 0
+
+    def validate_number(self, number):
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def get_page(self, number):
+        try:
+            number = self.validate_number(number)
+        except (PageNotAnInteger, EmptyPage):
+            number = 1
+        try:
+            return self.page(number)
+        except EmptyPage:
+            return self.page(1)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('That page contains no results')
+        if len(rows) <= self.per_page:
+            self.exact_count = bottom + len(rows)
+        self.loaded_number = number
+        return self._get_page(rows[:self.per_page], number, self)
+
+    @cached_property
+    def count_key(self):
+        try:
+            sql = str(self.object_list.query)
+        except EmptyResultSet:
+            return None
+        return 'count:' + hashlib.md5(sql.encode()).hexdigest()
+
+    def estimated_count(self, compute=True):
+        if self.count_ttl is None or self.count_key is None:
+            return None
+        if not compute:
+            return cache.get(self.count_key)
+        return cache.get_or_set(self.count_key, self.count_primary,
+                                self.count_ttl)
+
+    def count_primary(self):
+        with reading_primary():
+            return self.object_list.count()
+
+    @property
+    def count(self):
+        if self.exact_count is not None:
+            return self.exact_count
+        return self.estimated_count()
+
+    @property
+    def num_pages(self):
+        # Для has_next() хватает лишней строки, COUNT здесь не запускается.
+        if self.exact_count is not None:
+            return max(1, ceil(self.exact_count / self.per_page))
+        pages = self.loaded_number + 1
+        estimate = self.estimated_count(compute=False)
+        if estimate:
+            pages = max(pages, ceil(estimate / self.per_page))
+        return pages
+
+    @property
+    def page_range(self):
+        self.estimated_count()
+        return range(1, self.num_pages + 1)
+
+
+def paginate_page(queryset, request, cursor_paginator=CursorPaginator,
+                  count_ttl=COUNT_TTL):
+    # Из строк страницы рисуются общие фрагменты под новой версией ленты:
+    # отставшая реплика записала бы в них старый список.
+    with reading_primary():
+        return read_page(queryset, request, cursor_paginator, count_ttl)
 
 
-def paginate_page(queryset, request):
-    paginator = Paginator(queryset, NUM)
+def read_page(queryset, request, cursor_paginator, count_ttl):
+    cursor = request.GET.get('cursor')
+    if cursor is not None:
+        return cursor_paginator(queryset, NUM).page_from_cursor(cursor)
+    paginator = LazyCountPaginator(queryset, NUM, count_ttl=count_ttl)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
+    if page_obj.number >= CURSOR_FROM_PAGE and page_obj.has_next():
+        page_obj.next_cursor = encode_cursor(
+            cursor_paginator(queryset, NUM).position(page_obj[-1]))
     return page_obj
@@ -1,46 +1,108 @@
+from urllib.parse import urlencode
+
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
+from django.http import (Http404, HttpResponseBadRequest, JsonResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, redirect, render
 
+from core.routers import primary_writes, replica_reads
+
+from . import api, export, feeds
+from .comments import comments_page, serialize
+from .following import viewer_follows
 from .forms import CommentForm, PostForm
-from .models import Comment, Follow, Group, Post, User
-from .utils import paginate_page
+from .models import Follow, Group, Post, User
+from .search import search_posts
+from .timeline import Timeline, TimelinePaginator, timeline_page
+from .utils import NUM, LazyCountPaginator, paginate_page
+
+
+def index_feeds(request):
+    return [feeds.INDEX_FEED]
+
+
+def group_feeds(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True).first()
+    return None if group_id is None else [feeds.group_feed(group_id)]
+
+
+def profile_feeds(request, username):
+    author_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True).first()
+    if author_id is None:
+        return None
+    page_feeds = [feeds.profile_feed(author_id)]
+    if request.user.is_authenticated:
+        page_feeds.append(feeds.user_follow_feed(request.user.pk))
+    return page_feeds
 
 
+def post_feeds(request, post_id):
+    post = Post.objects.filter(pk=post_id).values_list(
+        'author_id', 'group_id').first()
+    if post is None:
+        return None
+    author_id, group_id = post
+    page_feeds = [feeds.post_key(post_id), feeds.profile_feed(author_id)]
+    if group_id is not None:
+        page_feeds.append(feeds.group_feed(group_id))
+    return page_feeds
+
+
+@replica_reads
+@feeds.conditional(index_feeds)
+@feeds.anonymous_cache(index_feeds)
 def index(request):
-    page_obj = paginate_page(Post.objects.all(), request)
+    page_obj = paginate_page(Post.objects.feed(), request)
     context = {
         'page_obj': page_obj,
+        'feed_version': feeds.feed_version(feeds.INDEX_FEED),
     }
     return render(request, 'posts/index.html', context)
 
 
+@replica_reads
+@feeds.conditional(group_feeds)
+@feeds.anonymous_cache(group_feeds)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    page_obj = paginate_page(group.posts.all(), request)
+    page_obj = paginate_page(group.posts.feed(), request)
     context = {
         'page_obj': page_obj,
         'group': group,
+        'feed_version': feeds.feed_version(feeds.group_feed(group.pk)),
     }
 
     return render(request, 'posts/group_list.html', context)
 
 
+@replica_reads
+@feeds.conditional(profile_feeds)
+@feeds.anonymous_cache(profile_feeds)
 def profile(request, username):
-    author_id = get_object_or_404(User, username=username)
-    page_obj = paginate_page(author_id.posts.all(), request)
-    following = author_id.following.exists()
+    author_id = get_object_or_404(
+        User.objects.select_related('counters'), username=username)
+    page_obj = paginate_page(author_id.posts.feed(), request)
+    following = author_id.pk in viewer_follows(request)
     context = {
         'page_obj': page_obj,
         'author_id': author_id,
-        'following': following
+        'following': following,
+        'feed_version': feeds.feed_version(feeds.profile_feed(author_id.pk)),
     }
     return render(request, 'posts/profile.html', context)
 
 
+@replica_reads
+@feeds.conditional(post_feeds)
+@feeds.anonymous_cache(post_feeds)
 def post_detail(request, post_id):
     form = CommentForm(request.POST or None)
-    post = get_object_or_404(Post, pk=post_id)
-    comments = Comment.objects.filter(post=post)
+    post = get_object_or_404(
+        Post.objects.feed().select_related('author__counters'), pk=post_id)
+    comments = comments_page(post.pk, request.GET.get('comments'))
     context = {
         'post': post,
         'form': form,
@@ -50,7 +112,20 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+@replica_reads
+@feeds.conditional(post_feeds)
+def post_comments(request, post_id):
+    if not Post.objects.filter(pk=post_id).exists():
+        raise Http404
+    page = comments_page(post_id, request.GET.get('cursor'))
+    return JsonResponse({
+        'comments': [serialize(comment) for comment in page],
+        'next': page.next_cursor,
+    })
+
+
 @login_required
+@primary_writes
 def post_create(request):
     form = PostForm(
         request.POST or None,
@@ -66,6 +141,7 @@ def post_create(request):
 
 
 @login_required
+@primary_writes
 def post_edit(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
     if post.author != request.user:
@@ -86,6 +162,7 @@ def post_edit(request, post_id):
 
 
 @login_required
+@primary_writes
 def add_comment(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     form = CommentForm(request.POST or None)
@@ -98,16 +175,71 @@ def add_comment(request, post_id):
 
 
 @login_required
+@replica_reads
 def follow_index(request):
-    posts = Post.objects.filter(author_id__following__user=request.user)
-    page_obj = paginate_page(posts, request)
+    page_obj = timeline_page(request.user, request)
     context = {
         'page_obj': page_obj,
+        'feed_version': feeds.feed_version(
+            feeds.FOLLOW_FEED, feeds.user_follow_feed(request.user.pk)),
     }
     return render(request, 'posts/follow.html', context)
 
 
+def follow_feeds(request):
+    if not request.user.is_authenticated:
+        return None
+    return [feeds.FOLLOW_FEED, feeds.user_follow_feed(request.user.pk)]
+
+
+@replica_reads
+@feeds.conditional(index_feeds)
+@feeds.anonymous_cache(index_feeds)
+def api_index(request):
+    return api.feed_response(request, Post.objects.all())
+
+
+@replica_reads
+@feeds.conditional(group_feeds)
+@feeds.anonymous_cache(group_feeds)
+def api_group(request, slug):
+    group = get_object_or_404(Group.objects.only('pk'), slug=slug)
+    return api.feed_response(request, Post.objects.filter(group=group))
+
+
+@replica_reads
+@feeds.conditional(profile_feeds)
+@feeds.anonymous_cache(profile_feeds)
+def api_profile(request, username):
+    author = get_object_or_404(User.objects.only('pk'), username=username)
+    return api.feed_response(request, Post.objects.filter(author=author))
+
+
+@replica_reads
+@feeds.conditional(follow_feeds)
+def api_follow(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Нужно войти'}, status=401)
+    return api.feed_response(
+        request, Timeline(request.user.pk), TimelinePaginator)
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    # Выдача упорядочена по релевантности, поэтому курсоры по дате не нужны.
+    paginator = LazyCountPaginator(
+        search_posts(query, Post.objects.feed()), NUM)
+    page_obj = paginator.get_page(request.GET.get('page'))
+    context = {
+        'page_obj': page_obj,
+        'query': query,
+        'page_query': urlencode({'q': query}) + '&',
+    }
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
+@primary_writes
 def profile_follow(request, username):
     author_post = get_object_or_404(User, username=username)
     if author_post != request.user:
@@ -116,7 +248,29 @@ def profile_follow(request, username):
 
 
 @login_required
+@primary_writes
 def profile_unfollow(request, username):
     author_post = get_object_or_404(User, username=username)
-    Follow.objects.get(user=request.user, author=author_post).delete()
+    Follow.objects.filter(user=request.user, author=author_post).delete()
     return redirect('posts:profile', username=username)
+
+
+@staff_member_required
+def export_table(request, table):
+    if table not in export.TABLES:
+        raise Http404
+    format_ = request.GET.get('format', 'ndjson')
+    if format_ not in export.FORMATS:
+        return HttpResponseBadRequest('Неизвестный формат')
+    since = None
+    if request.GET.get('since'):
+        try:
+            since = export.parse_since(request.GET['since'])
+        except ValueError as error:
+            return HttpResponseBadRequest(str(error))
+    response = StreamingHttpResponse(
+        export.stream([table], format_, since),
+        content_type=export.content_type(format_))
+    response['Content-Disposition'] = (
+        f'attachment; filename="{table}.{format_}"')
+    return response
@@ -8,6 +8,7 @@ urlpatterns = [
     path('about/', include('about.urls', namespace='about')),
     path('', include('posts.urls', namespace='posts')),
     path('admin/', admin.site.urls),
+    path('internal/', include('core.urls', namespace='core')),
     path('auth/', include('django.contrib.auth.urls')),
 ]
 if settings.DEBUG: